@@ -0,0 +1,167 @@
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+PERCENTILES = (5, 25, 75, 95)
+
+FIELDS = ['suite', 'variant', 'size', 'workers', 'trials', 'median', 'mean', 'min', 'max'] + \
+         ['p{0}'.format(p) for p in PERCENTILES] + ['throughput', 'speedup', 'efficiency']
+
+
+@contextlib.contextmanager
+def plain(function):
+    """
+    Runner of a function of the input data which needs no setup.
+    """
+    yield function
+
+
+class Case(object):
+    """
+    A variant of an algorithm to benchmark. The runner is a context manager factory: runner(workers)
+    sets the variant up (starts its pool, for example) and yields a function of the input data,
+    which is timed, and tears it down on exit.
+    """
+    def __init__(self, suite, variant, runner, make_input, parallel=True, sequential=False, max_size=None,
+                 fixed_workers=1):
+        """
+        :param suite: name of the algorithm, speedups are computed within a suite
+        :param variant: name of the variant
+        :param runner: function of the number of workers returning a context manager, which yields
+                       the function to time
+        :param make_input: function of the size returning the input data
+        :param parallel: if False, the variant is run once per size instead of once per worker count
+        :param fixed_workers: number of workers a variant which is not parallel uses on its own
+        :param sequential: if True, the variant is the reference of the speedups of its suite
+        :param max_size: larger sizes are skipped, for variants which are too slow for them
+        """
+        self.suite = suite
+        self.variant = variant
+        self.runner = runner
+        self.make_input = make_input
+        self.parallel = parallel
+        self.sequential = sequential
+        self.max_size = max_size
+        self.fixed_workers = fixed_workers
+
+
+def time_trials(function, data, warmups=1, trials=5):
+    """
+    Times function(data) with time.perf_counter after the warmup runs.
+    :return: list of times of the trials in seconds
+    """
+    for _ in range(warmups):
+        function(data)
+    times = []
+    for _ in range(trials):
+        start = time.perf_counter()
+        function(data)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times, size):
+    """
+    :return: dict of statistics of the times of the trials
+    """
+    times = np.asarray(times)
+    median = float(np.median(times))
+    summary = {
+        'trials': len(times),
+        'median': median,
+        'mean': float(times.mean()),
+        'min': float(times.min()),
+        'max': float(times.max()),
+        'throughput': size / median if median else float('inf'),
+    }
+    for p in PERCENTILES:
+        summary['p{0}'.format(p)] = float(np.percentile(times, p))
+    return summary
+
+
+def run_cases(cases, sizes, worker_counts, warmups=1, trials=5, quiet=True):
+    """
+    Runs every case over the grid of sizes and worker counts.
+    :param quiet: if True, the output of the algorithms (and of their workers) is discarded
+    :return: list of dicts with the fields FIELDS
+    """
+    results = []
+    for case in cases:
+        for size in sizes:
+            if case.max_size is not None and size > case.max_size:
+                continue
+            data = case.make_input(size)
+            for workers in (worker_counts if case.parallel else [case.fixed_workers]):
+                with open(os.devnull, 'w') as devnull:
+                    with contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext():
+                        with case.runner(workers) as function:
+                            times = time_trials(function, data, warmups, trials)
+                result = {'suite': case.suite, 'variant': case.variant, 'size': size, 'workers': workers}
+                result.update(summarize(times, size))
+                results.append(result)
+                print("{suite} {variant:>24} size {size:>9} workers {workers:>2}: "
+                      "median {median:.6f}s p95 {p95:.6f}s".format(**result))
+    _add_speedups(cases, results)
+    return results
+
+
+def _add_speedups(cases, results):
+    """
+    Speedup of a result is the median of the sequential variant of its suite at the same size divided
+    by its median, efficiency is the speedup per worker.
+    """
+    sequential = set((case.suite, case.variant) for case in cases if case.sequential)
+    reference = dict(((result['suite'], result['size']), result['median']) for result in results
+                     if (result['suite'], result['variant']) in sequential)
+    for result in results:
+        base = reference.get((result['suite'], result['size']))
+        result['speedup'] = base / result['median'] if base and result['median'] else None
+        result['efficiency'] = result['speedup'] / result['workers'] if result['speedup'] else None
+
+
+def write_json(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def write_csv(results, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares medians with the ones of the same (suite, variant, size, workers) in the baseline.
+    :param tolerance: allowed relative slowdown
+    :return: list of (result, baseline median) of the results slower than allowed
+    """
+    def key(result):
+        return result['suite'], result['variant'], result['size'], result['workers']
+
+    baseline = dict((key(result), result['median']) for result in baseline)
+    regressions = []
+    for result in results:
+        base = baseline.get(key(result))
+        if base is not None and result['median'] > base * (1 + tolerance):
+            regressions.append((result, base))
+    return regressions
+
+
+def report_regressions(regressions, out=sys.stdout):
+    for result, base in regressions:
+        out.write("REGRESSION {suite} {variant} size {size} workers {workers}: ".format(**result) +
+                  "median {0:.6f}s, baseline {1:.6f}s ({2:+.0%})\n".format(result['median'], base,
+                                                                          result['median'] / base - 1))
@@ -0,0 +1,182 @@
+"""
+Benchmarks of all the variants of MapReduce, merge sort and prefix sum over a grid of input sizes
+and worker counts, for example
+
+    python benchmarks/run_benchmarks.py --sizes 10 14 --workers 1 2 4 --json results.json
+    python benchmarks/run_benchmarks.py --sizes 10 14 --workers 1 2 4 --baseline results.json
+
+The second run exits with status 1 if a median is slower than in results.json by more than the tolerance.
+"""
+import argparse
+import collections
+import contextlib
+import importlib.util
+import multiprocessing
+import os
+import random
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for project in ('da-mapreduce', 'dist_alg_lab_1', 'pda-mergesort'):
+    sys.path.insert(0, os.path.join(ROOT, project))
+
+import tracing
+from harness import Case, compare, plain, report_regressions, run_cases, write_csv, write_json, load_results
+from array_mapreduce import ArrayMapReduce
+from digit_count import digit_count_mapper, digit_count_reducer
+from parallel_mapreduce import MapReduce
+from parallel_scan import ParallelScanner
+from parallel_sort import ParallelSorter
+from prefix_sum import parallel_prefix_sum, sequential_prefix_sum
+
+
+def _load_merge_sort():
+    """
+    merge-sort.py can't be imported by name, it is loaded as module merge_sort.
+    """
+    spec = importlib.util.spec_from_file_location('merge_sort', os.path.join(ROOT, 'pda-mergesort', 'merge-sort.py'))
+    module = importlib.util.module_from_spec(spec)
+    # workers of the naive parallel sort unpickle its functions by the name of the module
+    sys.modules['merge_sort'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+merge_sort = _load_merge_sort()
+
+
+def _digits(size):
+    return np.random.randint(0, 10, size).tolist()
+
+
+def _permutation(size):
+    return random.sample(range(size), size)
+
+
+def _ones(size):
+    return [1] * size
+
+
+def sequential_digit_count(digits):
+    """
+    The mapper and reducer of digit_count applied in a single process.
+    """
+    mapped = collections.defaultdict(list)
+    for digit in digits:
+        digit_count_mapper(digit, mapped)
+    counts = collections.defaultdict(int)
+    for digit, values in mapped.items():
+        digit_count_reducer(digit, values, counts)
+    return sorted(counts.items())
+
+
+def mapreduce_job(backend='process'):
+    @contextlib.contextmanager
+    def runner(workers):
+        with MapReduce(digit_count_mapper, digit_count_reducer, workers, the_combiner=digit_count_reducer,
+                       backend=backend) as job:
+            yield lambda digits: job(digits, workers)
+    return runner
+
+
+@contextlib.contextmanager
+def array_mapreduce_job(workers):
+    with ArrayMapReduce('histogram', num_workers=workers) as job:
+        yield lambda digits: job(digits, workers)
+
+
+def _sorter(algorithm, backend='process'):
+    @contextlib.contextmanager
+    def runner(workers):
+        with ParallelSorter(workers, backend) as sorter:
+            yield getattr(sorter, algorithm)
+    return runner
+
+
+def pooled_scan(backend='process'):
+    @contextlib.contextmanager
+    def runner(workers):
+        with ParallelScanner(workers, backend) as scanner:
+            yield scanner.prefix_sum
+    return runner
+
+
+SUITES = {
+    'mapreduce': [
+        Case('mapreduce', 'sequential', lambda workers: plain(sequential_digit_count), _digits,
+             parallel=False, sequential=True),
+        Case('mapreduce', 'MapReduce', mapreduce_job(), _digits),
+        Case('mapreduce', 'MapReduce auto', mapreduce_job('auto'), _digits),
+        Case('mapreduce', 'ArrayMapReduce', array_mapreduce_job, lambda size: np.array(_digits(size), np.int8)),
+    ],
+    'mergesort': [
+        Case('mergesort', 'sequential', lambda workers: plain(merge_sort.sequential_merge_sort), _permutation,
+             parallel=False, sequential=True),
+        Case('mergesort', 'naive parallel', lambda workers: plain(merge_sort.parallel_naive_merge_sort),
+             _permutation, parallel=False, fixed_workers=multiprocessing.cpu_count()),
+        Case('mergesort', 'shared-array parallel', lambda workers: plain(merge_sort.parallel_merge_sort),
+             _permutation, parallel=False, max_size=2 ** 16, fixed_workers=multiprocessing.cpu_count()),
+        Case('mergesort', 'pooled merge', _sorter('merge_sort'), lambda size: np.array(_permutation(size))),
+        Case('mergesort', 'pooled merge threads', _sorter('merge_sort', 'thread'),
+             lambda size: np.array(_permutation(size))),
+        Case('mergesort', 'pooled merge auto', _sorter('merge_sort', 'auto'), lambda size: np.array(_permutation(size))),
+        Case('mergesort', 'pooled k-way', _sorter('kway_merge_sort'), lambda size: np.array(_permutation(size))),
+        Case('mergesort', 'pooled sample', _sorter('sample_sort'), lambda size: np.array(_permutation(size))),
+        Case('mergesort', 'pooled radix', _sorter('radix_sort'), lambda size: np.array(_permutation(size))),
+        Case('mergesort', 'numpy.sort', lambda workers: plain(np.sort), lambda size: np.array(_permutation(size)),
+             parallel=False),
+    ],
+    'prefix-sum': [
+        Case('prefix-sum', 'sequential', lambda workers: plain(sequential_prefix_sum), _ones,
+             parallel=False, sequential=True),
+        Case('prefix-sum', 'Blelloch parallel', lambda workers: plain(lambda data: parallel_prefix_sum(data, workers)),
+             _ones, max_size=2 ** 16),
+        Case('prefix-sum', 'pooled blocked', pooled_scan(), lambda size: np.ones(size, np.int64)),
+        Case('prefix-sum', 'pooled blocked threads', pooled_scan('thread'), lambda size: np.ones(size, np.int64)),
+        Case('prefix-sum', 'pooled blocked auto', pooled_scan('auto'), lambda size: np.ones(size, np.int64)),
+        Case('prefix-sum', 'numpy.cumsum', lambda workers: plain(np.cumsum), lambda size: np.ones(size, np.int64),
+             parallel=False),
+    ],
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of MapReduce, merge sort and prefix sum")
+    parser.add_argument('--suites', nargs='+', choices=sorted(SUITES), default=sorted(SUITES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 14], help="powers of two of the input sizes")
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4], help="worker counts of parallel variants")
+    parser.add_argument('--warmups', type=int, default=1)
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--json', help="file to write the results to as JSON")
+    parser.add_argument('--csv', help="file to write the results to as CSV")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative slowdown of a median")
+    parser.add_argument('--verbose', action='store_true', help="keep the output of the algorithms")
+    parser.add_argument('--trace', help="file to write a Chrome trace of all the runs to")
+    args = parser.parse_args(argv)
+
+    random.seed(128)
+    np.random.seed(128)
+    cases = [case for suite in args.suites for case in SUITES[suite]]
+    if args.trace:
+        tracing.enable()
+    results = run_cases(cases, [2 ** p for p in args.sizes], args.workers, args.warmups, args.trials,
+                        quiet=not args.verbose)
+    if args.json:
+        write_json(results, args.json)
+    if args.csv:
+        write_csv(results, args.csv)
+    if args.trace:
+        tracing.export_chrome_trace(args.trace)
+    if args.baseline:
+        regressions = compare(results, load_results(args.baseline), args.tolerance)
+        report_regressions(regressions)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
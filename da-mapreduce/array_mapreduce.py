@@ -0,0 +1,190 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import dataset
+import executors
+import tracing
+from parallel_mapreduce import MapReduce
+from scheduler import _attach_shared_memory
+
+
+def _count(chunk):
+    return chunk.shape[0]
+
+
+def _sum(chunk):
+    return chunk.sum(axis=0)
+
+
+def _min(chunk):
+    return chunk.min(axis=0)
+
+
+def _max(chunk):
+    return chunk.max(axis=0)
+
+
+def _merge_extremes(ufunc, partials):
+    """
+    Reduces partial minimums or maximums of the chunks element-wise, they are row vectors for 2-D input.
+    """
+    if not partials:
+        raise ValueError("zero-size array to reduction operation {0} which has no identity".format(ufunc.__name__))
+    return ufunc.reduce(partials)
+
+
+def _merge_min(partials):
+    return _merge_extremes(np.minimum, partials)
+
+
+def _merge_max(partials):
+    return _merge_extremes(np.maximum, partials)
+
+
+def _bincount(chunk):
+    return np.bincount(chunk.ravel())
+
+
+def _merge_bincounts(partials):
+    """
+    Adds up histograms of different length, the shorter ones are padded with zeros.
+    """
+    merged = np.zeros(max((len(partial) for partial in partials), default=0), dtype=np.int64)
+    for partial in partials:
+        merged[:len(partial)] += partial
+    return merged
+
+
+def _value_counts(chunk):
+    return np.unique(chunk.ravel(), return_counts=True)
+
+
+def _merge_value_counts(partials):
+    """
+    Merges (keys, counts) pairs of every chunk: keys are sorted and counts of equal keys
+    are summed up with np.add.reduceat.
+    """
+    if not partials:
+        return np.array([]), np.array([], dtype=np.int64)
+    keys = np.concatenate([keys for keys, _ in partials])
+    counts = np.concatenate([counts for _, counts in partials])
+    order = np.argsort(keys, kind='stable')
+    keys, counts = keys[order], counts[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+# built-in aggregations: name -> (mapper applied to every chunk, reducer of the list of partial results)
+AGGREGATIONS = {
+    'count': (_count, sum),
+    'sum': (_sum, sum),
+    'min': (_min, _merge_min),
+    'max': (_max, _merge_max),
+    'histogram': (_bincount, _merge_bincounts),
+    'value_counts': (_value_counts, _merge_value_counts),
+}
+
+
+class ArrayMapReduce(MapReduce):
+    """
+    MapReduce over a NumPy array. The array is copied once into shared memory and every worker maps
+    a contiguous slice of it viewed in place, so no element is pickled. The mapper receives a whole
+    chunk and returns a partial result, the reducer receives the list of partial results of all chunks.
+    """
+    # the built-in aggregations are NumPy kernels which release the GIL
+    gil_free = True
+
+    def __init__(self, the_mapper, the_reducer=None, num_workers=None, chunk_size=2 ** 22, backend='process',
+                 scheduler=None):
+        """
+        :param the_mapper: function of a chunk (ndarray) or name of a built-in aggregation from AGGREGATIONS,
+                           in which case the_reducer is taken from the aggregation too
+        :param the_reducer: function of the list of results of the mapper
+        :param num_workers: size of the worker pool, defaults to number of CPUs
+        :param chunk_size: maximum number of rows (elements along the first axis) in a chunk
+        :param backend: 'serial', 'thread', 'process' or 'auto' to pick it for every job from the size of the input
+        :param scheduler: TaskScheduler of map tasks, see WorkerPool
+        """
+        if isinstance(the_mapper, str):
+            the_mapper, the_reducer = AGGREGATIONS[the_mapper]
+        super(ArrayMapReduce, self).__init__(the_mapper, the_reducer, num_workers, backend=backend,
+                                             scheduler=scheduler)
+        self.chunk_size = chunk_size
+
+    def _estimate_work(self, inputs, sample_size=2 ** 12):
+        """
+        Times the mapper on the first rows of the array.
+        :return: estimated time in seconds the job takes serially
+        """
+        inputs = np.asarray(inputs)
+        length = inputs.shape[0] if inputs.ndim else 0
+        if not length:
+            return 0.0
+        sample = inputs[:sample_size]
+        return executors.measure_work(self.the_mapper, sample) * length / len(sample)
+
+    def _mapper(self, shm_name, shape, dtype, id_start, id_end, worker_number):
+        """
+        Implements map part which is done by each Worker(Process) in parallel over rows
+        between id_start and id_end of the shared array.
+        """
+        print("Thread {0} is working".format(worker_number))
+        print("It processes indexes of input array between {0} and {1}".format(id_start, id_end))
+        shm = _attach_shared_memory(shm_name)
+        try:
+            row_bytes = np.dtype(dtype).itemsize * int(np.prod(shape[1:]))
+            chunk = np.ndarray((id_end - id_start,) + tuple(shape[1:]), dtype=dtype,
+                               buffer=shm.buf, offset=id_start * row_bytes)
+            result = self.the_mapper(chunk)
+            if isinstance(result, np.ndarray) and np.may_share_memory(result, chunk):
+                result = result.copy()
+            del chunk
+            return result
+        finally:
+            shm.close()
+
+    def map_parallel(self, input, num_threads=4, verbose=False):
+        """
+        Map part of the job: the array is split along the first axis into at least num_threads chunks
+        of at most chunk_size rows.
+        :param input: ndarray (or anything np.asarray accepts, like a dataset.Dataset, which is read
+                      through a memory map)
+        :param num_threads: minimal number of chunks
+        :return: list of results of the mapper per chunk
+        """
+        input = np.asarray(input)
+        length = input.shape[0] if input.ndim else 0
+        shm = shared_memory.SharedMemory(create=True, size=max(input.nbytes, 1))
+        try:
+            shared = np.ndarray(input.shape, dtype=input.dtype, buffer=shm.buf)
+            shared[...] = input
+            del shared
+            chunksize = max(min(self.chunk_size, -(-length // num_threads)), 1)
+            tasks = ((shm.name, input.shape, input.dtype, id_start, min(id_start + chunksize, length), i)
+                     for i, id_start in enumerate(range(0, length, chunksize)))
+            with tracing.span('map', 'mapreduce'):
+                return self._run_tasks(self._mapper, tasks, verbose)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    @staticmethod
+    def _write_output(result, path):
+        """
+        Writes the result of the reducer to a dataset file as an array, (keys, values) arrays
+        like the result of value_counts as records with the fields key and value.
+        """
+        if isinstance(result, tuple):
+            dataset.write_fields(path, [('key', result[0]), ('value', result[1])])
+        else:
+            dataset.write(path, result)
+
+    def reduce_parallel(self, partials, num_threads=4, verbose=False):
+        """
+        Reduce part of the job: partial results are small, so they are merged in the calling process.
+        :param partials: result of map_parallel
+        :param num_threads: not used, the merge isn't parallel
+        :return: result of the reducer
+        """
+        return self.the_reducer(partials)
@@ -3,8 +3,12 @@ import sys
 import time
 
 from utils.format_output import wrap_list
-from numpy import random
+from numpy import array, int8, random
 
+import dataset
+from array_mapreduce import ArrayMapReduce
+from distributed import RemotePool
+from map_cache import MapOutputCache
 from parallel_mapreduce import MapReduce
 from utils.console_output_to_file import copyConsoleToFile
 
@@ -13,6 +17,16 @@ def digit_count_mapper(input_el, output):
     output[input_el] += [1]
 
 
+def digit_count_line_mapper(input_line, output):
+    """
+    Mapper for lines of input.txt: digits separated by commas, the header and brackets are skipped
+    """
+    for token in input_line.strip('[]').split(','):
+        token = token.strip()
+        if token.isdigit():
+            output[int(token)] += [1]
+
+
 def digit_count_reducer(input_key, input_value, output):
     output[input_key] += sum(input_value)
 
@@ -23,23 +37,64 @@ if __name__ == '__main__':
     power = 10
     print_input = False
     num_workers = 4
+    # read input.txt back lazily line by line, spilling map output to disk, instead of the dataset file
+    stream_from_file = False
+    # count digits with vectorized histograms over chunks of a shared array
+    array_mode = False
+    # addresses 'host:port' of worker daemons started with `python distributed.py worker --host ... --port 5000`
+    # on other nodes, with the shared secret in MAPREDUCE_AUTHKEY, if empty the job runs on local worker processes
+    worker_addresses = []
+    # directory to keep map outputs of splits in, a rerun over a partly changed input maps only the changed splits
+    cache_dir = None
     tlogger = copyConsoleToFile('logfile.txt', 'w')
-    input_digits = list(random.choice(population, 2 ** power))
+    input_digits = random.choice(population, 2 ** power).tolist()
 
     if print_input:
         print("Input digits")
         wrap_list(input_digits)
         # print("input digits \n", input_digits)
-    # save to a text file
-    with open(os.path.dirname(sys.argv[0]) + '\\input.txt', 'w') as f:
-        # f.write(' '.join(str(e) for e in input_digits))
-        f.write("Input digits\n"+wrap_list(input_digits))
+    directory = os.path.dirname(sys.argv[0])
+    # save to a dataset file with a chunk per worker, map tasks read their chunks through a memory map
+    data_path = os.path.join(directory, 'input.ds')
+    dataset.write(data_path, array(input_digits, dtype=int8), chunk_length=-(-len(input_digits) // num_workers))
+    # the result is saved as (digit, count) records
+    result_path = os.path.join(directory, 'result.ds')
+    input_path = os.path.join(directory, 'input.txt')
+    if stream_from_file:
+        # save to a text file
+        with open(input_path, 'w') as f:
+            # f.write(' '.join(str(e) for e in input_digits))
+            f.write("Input digits\n"+wrap_list(input_digits))
+
+    backend = 'process'
+    if worker_addresses:
+        # workers import the functions by module name, which has to be digit_count and not __main__
+        from digit_count import digit_count_line_mapper, digit_count_mapper, digit_count_reducer
+        backend = RemotePool(worker_addresses)
+    cache = MapOutputCache(cache_dir) if cache_dir else None
 
-    map_reduce_job = MapReduce(digit_count_mapper, digit_count_reducer)
+    if array_mode:
+        map_reduce_job = ArrayMapReduce('histogram', num_workers=num_workers, backend=backend)
+        job_input = dataset.Dataset(data_path)
+    elif stream_from_file:
+        map_reduce_job = MapReduce(digit_count_line_mapper, digit_count_reducer, num_workers,
+                                   the_combiner=digit_count_reducer, spill_threshold=2 ** 16, backend=backend,
+                                   cache=cache)
+        job_input = input_path
+    else:
+        map_reduce_job = MapReduce(digit_count_mapper, digit_count_reducer, num_workers,
+                                   the_combiner=digit_count_reducer, backend=backend, cache=cache)
+        job_input = dataset.Dataset(data_path)
 
-    start = time.time()
-    digit_counts = map_reduce_job(input_digits, num_workers, True)
-    end = time.time()
+    with map_reduce_job:
+        start = time.time()
+        digit_counts = map_reduce_job(job_input, num_workers, True, output=result_path)
+        end = time.time()
+    if worker_addresses:
+        backend.close()
+        backend.join()
+    if array_mode:
+        digit_counts = enumerate(digit_counts)
 
     digit_sum = 0
     print('\nResult of count digits with mapreduce\n')
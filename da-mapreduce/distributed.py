@@ -0,0 +1,532 @@
+"""
+Runs MapReduce jobs on worker daemons, which may be on other machines. Workers run the functions they are sent,
+so the coordinator and the workers authenticate each other with a shared secret, taken from the environment
+variable MAPREDUCE_AUTHKEY or passed as authkey. Start a worker on every node from this directory, so that it
+can import the mapper and reducer by name, listening on the address other nodes reach it at (a worker listens
+only on localhost by default):
+
+    MAPREDUCE_AUTHKEY=secret python distributed.py worker --host 10.0.0.1 --port 5000
+
+and pass a RemotePool with their addresses as the backend of the job:
+
+    with RemotePool(['node1:5000', 'node2:5000'], authkey=b'secret') as pool:
+        with MapReduce(digit_count_mapper, digit_count_reducer, backend=pool) as job:
+            job(digits, 8)
+
+Functions are pickled by reference, they have to be defined in a module the workers can import (not in __main__).
+Input files and spilled runs are read by path, so they have to be on a filesystem shared by all the nodes.
+"""
+import argparse
+import collections
+import hashlib
+import hmac
+import multiprocessing
+import os
+import pickle
+import socket
+import socketserver
+import struct
+import threading
+import traceback
+import zlib
+
+# header of a message: length of the payload and flags
+_HEADER = struct.Struct('!QB')
+_COMPRESSED = 1
+
+AUTHKEY_ENV = 'MAPREDUCE_AUTHKEY'
+_NONCE_SIZE = 32
+# seconds a peer has to answer the challenge
+_AUTH_TIMEOUT = 10.0
+
+
+def _parse_address(address):
+    """
+    :param address: 'host:port' or (host, port)
+    :return: (host, port)
+    """
+    if isinstance(address, str):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return tuple(address)
+
+
+def make_frame(message, compress_above=2 ** 16):
+    """
+    Pickles an object into a frame: header and pickled payload, compressed with zlib if it is larger
+    than compress_above bytes and compression pays off. Pickling errors are raised before anything is sent,
+    so the connection stays usable.
+    :return: (header, payload)
+    """
+    payload = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    flags = 0
+    if len(payload) > compress_above:
+        compressed = zlib.compress(payload, 1)
+        if len(compressed) < len(payload):
+            payload, flags = compressed, _COMPRESSED
+    return _HEADER.pack(len(payload), flags), payload
+
+
+def send_frame(sock, frame):
+    header, payload = frame
+    sock.sendall(header)
+    sock.sendall(payload)
+
+
+def send_message(sock, message, compress_above=2 ** 16):
+    """
+    Sends a picklable object as a single frame, see make_frame.
+    """
+    send_frame(sock, make_frame(message, compress_above))
+
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise EOFError("connection closed by the peer")
+        received += count
+    return buffer
+
+
+def recv_payload(sock):
+    """
+    Receives a frame sent by send_message.
+    :return: pickled payload, unpickle it with pickle.loads
+    """
+    size, flags = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    payload = _recv_exactly(sock, size)
+    return zlib.decompress(payload) if flags & _COMPRESSED else payload
+
+
+def recv_message(sock):
+    """
+    Receives an object sent by send_message.
+    """
+    return pickle.loads(recv_payload(sock))
+
+
+def _authkey(authkey=None):
+    """
+    :return: the shared secret as bytes, from the environment variable if authkey is None
+    """
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_ENV)
+    if not authkey:
+        raise ValueError("workers run the code they are sent, they need a shared secret: pass authkey "
+                         "or set the environment variable {0}".format(AUTHKEY_ENV))
+    return authkey.encode('utf-8') if isinstance(authkey, str) else bytes(authkey)
+
+
+def _digest(authkey, role, nonce):
+    # the role is signed too, so that a challenge can't be answered by sending it back to its sender
+    return hmac.new(authkey, role + nonce, hashlib.sha256).digest()
+
+
+def _challenge(sock, authkey, role):
+    """
+    Sends a random nonce and checks that the peer signed it with the shared secret.
+    """
+    nonce = os.urandom(_NONCE_SIZE)
+    sock.sendall(nonce)
+    if not hmac.compare_digest(bytes(_recv_exactly(sock, hashlib.sha256().digest_size)),
+                               _digest(authkey, role, nonce)):
+        raise multiprocessing.AuthenticationError("peer doesn't know the shared secret")
+
+
+def _answer(sock, authkey, role):
+    """
+    Signs the nonce sent by the peer with the shared secret.
+    """
+    sock.sendall(_digest(authkey, role, bytes(_recv_exactly(sock, _NONCE_SIZE))))
+
+
+def authenticate_worker(sock, authkey):
+    """
+    Worker side of the mutual authentication: the coordinator proves it knows the secret before it is
+    allowed to send tasks, then the worker proves it, before its results are unpickled.
+    """
+    _challenge(sock, authkey, b'coordinator')
+    _answer(sock, authkey, b'worker')
+
+
+def authenticate_coordinator(sock, authkey):
+    """
+    Coordinator side of the mutual authentication, see authenticate_worker.
+    """
+    _answer(sock, authkey, b'coordinator')
+    _challenge(sock, authkey, b'worker')
+
+
+def _picklable(error):
+    """
+    Exceptions are sent back to the coordinator as they are, the ones which can't be pickled
+    are replaced by a RuntimeError with the traceback of the worker.
+    """
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+
+
+class _TaskHandler(socketserver.BaseRequestHandler):
+    """
+    Serves a connection of the coordinator: once it is authenticated, runs the (function, args) tasks
+    sent over it one by one and sends back (True, result) or (False, exception).
+    """
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.request.settimeout(_AUTH_TIMEOUT)
+        try:
+            authenticate_worker(self.request, self.server.authkey)
+        except (multiprocessing.AuthenticationError, EOFError, OSError) as error:
+            print("Connection from {0}:{1} is refused: {2}".format(*self.client_address[:2], error))
+            return
+        self.request.settimeout(None)
+        print("Coordinator {0}:{1} connected".format(*self.client_address[:2]))
+        while True:
+            try:
+                payload = recv_payload(self.request)
+            except (EOFError, OSError):
+                print("Coordinator {0}:{1} disconnected".format(*self.client_address[:2]))
+                return
+            try:
+                function, args = pickle.loads(payload)
+                # the result is pickled here, so that a result which can't be is reported as the error of the task
+                reply = make_frame((True, function(*args)))
+            except Exception as error:
+                reply = make_frame((False, _picklable(error)))
+            del payload
+            send_frame(self.request, reply)
+
+
+class _WorkerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(host='127.0.0.1', port=5000, ready=None, authkey=None):
+    """
+    Runs a worker daemon: every connection is served by a thread, the coordinator opens one connection
+    per task slot. Run several daemons to use several cores of a machine.
+    :param host: address to listen on, only localhost by default, other nodes need the address of the interface
+                 they reach the worker through
+    :param ready: optional queue to put the port to once the worker listens, useful with port 0
+    :param authkey: shared secret of the coordinator and the workers, MAPREDUCE_AUTHKEY by default
+    """
+    authkey = _authkey(authkey)
+    with _WorkerServer((host, port), _TaskHandler) as server:
+        server.authkey = authkey
+        print("Worker is listening on {0}:{1}".format(*server.server_address[:2]))
+        if ready is not None:
+            ready.put(server.server_address[1])
+        server.serve_forever()
+
+
+class _RemoteResult(object):
+    """
+    Result of a task submitted to RemotePool, with the interface of multiprocessing.pool.AsyncResult.
+    """
+    def __init__(self, function, args, callback=None, error_callback=None):
+        self.function = function
+        self.args = args
+        self.callback = callback
+        self.error_callback = error_callback
+        # indexes of the workers the task failed on and the number of its failures
+        self.failed_on = set()
+        self.failures = 0
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def _set(self, value=None, error=None):
+        self._value, self._error = value, error
+        self.function = self.args = None
+        self._event.set()
+        if error is None and self.callback is not None:
+            self.callback(value)
+        elif error is not None and self.error_callback is not None:
+            self.error_callback(error)
+
+    def ready(self):
+        return self._event.is_set()
+
+    def successful(self):
+        return self.ready() and self._error is None
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+
+    def get(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise multiprocessing.TimeoutError
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class RemotePool(object):
+    """
+    Runs tasks on worker daemons over TCP with the part of the interface of multiprocessing.Pool used by
+    WorkerPool, so a MapReduce job takes it as its backend. Every connection is served by a dispatcher
+    thread which takes the next task from the queue, so faster workers take more tasks. Connections
+    are opened once and reused by all the tasks and jobs until close() is called.
+
+    A task which raises or whose worker can't be reached is retried on another worker, up to max_retries
+    times, retries go to the front of the queue. A worker which can't be reconnected to is dropped from the pool.
+    The dispatchers stop after close() only once no task is left unfinished, so retries are never stranded.
+    """
+    def __init__(self, addresses, connections_per_worker=1, max_retries=2, connect_timeout=10.0, authkey=None):
+        """
+        :param addresses: list of 'host:port' or (host, port) of the worker daemons
+        :param connections_per_worker: number of tasks every worker runs at a time
+        :param max_retries: number of times a failed task is resubmitted
+        :param connect_timeout: timeout in seconds of connecting to a worker
+        :param authkey: shared secret of the coordinator and the workers, MAPREDUCE_AUTHKEY by default
+        """
+        if not addresses:
+            raise ValueError("RemotePool needs at least one worker address")
+        self.addresses = [_parse_address(address) for address in addresses]
+        self.authkey = _authkey(authkey)
+        self.num_workers = len(self.addresses) * connections_per_worker
+        self.max_retries = max_retries
+        self.connect_timeout = connect_timeout
+        # queued tasks and the number of tasks submitted and not finished yet, including running ones
+        self._tasks = collections.deque()
+        self._unfinished = 0
+        self._changed = threading.Condition()
+        self._lock = threading.Lock()
+        self._dead = set()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._dispatch, args=(worker,), daemon=True)
+                         for worker in range(len(self.addresses)) for _ in range(connections_per_worker)]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        self.join()
+
+    def _connect(self, worker):
+        connection = socket.create_connection(self.addresses[worker], self.connect_timeout)
+        try:
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            authenticate_coordinator(connection, self.authkey)
+        except (multiprocessing.AuthenticationError, EOFError) as error:
+            connection.close()
+            raise ConnectionRefusedError("worker {0}:{1} failed authentication: {2}".format(
+                *self.addresses[worker], error))
+        except OSError:
+            connection.close()
+            raise
+        connection.settimeout(None)
+        return connection
+
+    def _alive_except(self, failed_on):
+        """
+        :return: True if there is a live worker the task didn't fail on
+        """
+        with self._lock:
+            return any(worker not in self._dead and worker not in failed_on for worker in range(len(self.addresses)))
+
+    def _finish(self, task, value=None, error=None):
+        try:
+            task._set(value, error)
+        finally:
+            with self._changed:
+                self._unfinished -= 1
+                self._changed.notify_all()
+
+    def _failed(self, task, worker, error):
+        """
+        Resubmits the failed task or, if it is out of retries, sets the error as its result.
+        """
+        task.failed_on.add(worker)
+        task.failures += 1
+        if task.failures > self.max_retries or not self._alive_except(()):
+            self._finish(task, error=error)
+            return
+        print("Task {0} failed on {1}:{2} with {3!r}, retrying".format(
+            getattr(task.function, '__name__', task.function), *self.addresses[worker], error))
+        with self._changed:
+            self._tasks.appendleft(task)
+            self._changed.notify_all()
+
+    def _next_task(self, worker):
+        """
+        Waits for a queued task the worker may run, tasks which failed on it are left to other live workers.
+        :return: the task or None once the pool is closed and all the tasks are finished
+        """
+        with self._changed:
+            while True:
+                for task in self._tasks:
+                    if worker not in task.failed_on or not self._alive_except(task.failed_on):
+                        self._tasks.remove(task)
+                        return task
+                if self._closed and not self._unfinished:
+                    return None
+                self._changed.wait()
+
+    def _dispatch(self, worker):
+        """
+        Runs tasks from the queue on a connection to the worker until the pool is closed or the worker is dead.
+        """
+        connection = None
+        try:
+            while True:
+                task = self._next_task(worker)
+                if task is None:
+                    return
+                try:
+                    request = make_frame((task.function, task.args))
+                except Exception as error:
+                    # it can't be pickled on any worker, like a lambda or a lock, so it isn't retried
+                    self._finish(task, error=error)
+                    continue
+                try:
+                    if connection is None:
+                        connection = self._connect(worker)
+                    send_frame(connection, request)
+                    del request
+                    payload = recv_payload(connection)
+                except (OSError, EOFError) as error:
+                    if connection is not None:
+                        connection.close()
+                        connection = None
+                    self._failed(task, worker, error)
+                    try:
+                        connection = self._connect(worker)
+                    except OSError:
+                        print("Worker {0}:{1} is unreachable, it is dropped".format(*self.addresses[worker]))
+                        with self._lock:
+                            self._dead.add(worker)
+                        with self._changed:
+                            # tasks this worker skipped may be left to the others now
+                            self._changed.notify_all()
+                        return
+                    continue
+                try:
+                    ok, value = pickle.loads(payload)
+                except Exception as error:
+                    # the whole frame is read, so the connection is still in sync, the result can't be loaded
+                    # here, e.g. its class isn't importable by the coordinator
+                    self._finish(task, error=error)
+                    continue
+                del payload
+                if ok:
+                    self._finish(task, value)
+                else:
+                    self._failed(task, worker, value)
+        finally:
+            if connection is not None:
+                connection.close()
+            self._drain_if_all_dead()
+
+    def _drain_if_all_dead(self):
+        """
+        Fails the queued tasks when no worker is left to run them.
+        """
+        if self._alive_except(()):
+            return
+        with self._changed:
+            tasks = list(self._tasks)
+            self._tasks.clear()
+        for task in tasks:
+            self._finish(task, error=ConnectionError("no worker of the pool is reachable"))
+
+    def apply_async(self, func, args=(), kwds=None, callback=None, error_callback=None):
+        """
+        Submits func(*args) to the workers.
+        :return: result with get() like multiprocessing.pool.AsyncResult
+        """
+        if self._closed:
+            raise ValueError("Pool not running")
+        if kwds:
+            raise TypeError("keyword arguments aren't supported by RemotePool")
+        task = _RemoteResult(func, args, callback, error_callback)
+        if not self._alive_except(()):
+            task._set(error=ConnectionError("no worker of the pool is reachable"))
+            return task
+        with self._changed:
+            self._tasks.append(task)
+            self._unfinished += 1
+            self._changed.notify()
+        return task
+
+    def close(self):
+        """
+        Lets the dispatchers finish the queued tasks, with their retries, and close their connections.
+        """
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    def terminate(self):
+        self.close()
+        self.join()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+
+class LocalCluster(object):
+    """
+    Starts worker daemons as processes on localhost, to try out or test a distributed job on one machine:
+    >> with LocalCluster(4) as cluster, RemotePool(cluster.addresses, authkey=cluster.authkey) as pool:
+    """
+    def __init__(self, num_workers=None, host='127.0.0.1', authkey=None):
+        """
+        :param num_workers: number of worker daemons, defaults to number of CPUs
+        :param authkey: shared secret of the workers, a random one by default
+        """
+        self.host = host
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.authkey = authkey if authkey is not None else os.urandom(32)
+        self.processes = []
+        self.addresses = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        ready = multiprocessing.Queue()
+        for _ in range(self.num_workers):
+            process = multiprocessing.Process(target=serve, args=(self.host, 0, ready, self.authkey),
+                                              daemon=True)
+            process.start()
+            self.processes.append(process)
+            self.addresses.append('{0}:{1}'.format(self.host, ready.get()))
+        return self
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        self.processes = []
+        self.addresses = []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Worker daemon of distributed MapReduce")
+    parser.add_argument('mode', choices=['worker'])
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on, set it to expose the worker to other nodes")
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--authkey-file', help="file with the shared secret, {0} by default".format(AUTHKEY_ENV))
+    args = parser.parse_args()
+    authkey = None
+    if args.authkey_file:
+        with open(args.authkey_file, 'rb') as f:
+            authkey = f.read().strip()
+    serve(args.host, args.port, authkey=authkey)
@@ -0,0 +1,145 @@
+import hashlib
+import itertools
+import os
+import pickle
+
+from dataset import Dataset
+
+
+class RecordSplit(object):
+    """
+    A chunk of records which is processed by one map task.
+    """
+    def __init__(self, records, id_start):
+        self.records = records
+        self.id_start = id_start
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def fingerprint(self):
+        """
+        :return: hex digest of the records, equal records give equal fingerprints across runs
+        """
+        return hashlib.blake2b(pickle.dumps(self.records, pickle.HIGHEST_PROTOCOL), digest_size=16).hexdigest()
+
+    def __str__(self):
+        return "indexes of input array between {0} and {1}".format(self.id_start, self.id_start + len(self.records))
+
+
+class FileSplit(object):
+    """
+    A byte range [start, end) of a text file. Records are lines, a line belongs to the split
+    in which it starts, so lines crossing the boundary are read by exactly one split.
+    The file is opened and read lazily by the worker iterating over the split.
+    """
+    def __init__(self, path, start, end, encoding='utf-8'):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.encoding = encoding
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            position = self.start
+            if position > 0:
+                # skip the tail of the line started in the previous split
+                f.seek(position - 1)
+                position += len(f.readline()) - 1
+            while position < self.end:
+                line = f.readline()
+                if not line:
+                    break
+                position += len(line)
+                yield line.rstrip(b'\r\n').decode(self.encoding)
+
+    def fingerprint(self, block_size=2 ** 20):
+        """
+        Hashes the bytes the records of the split are read from: the byte before the start, which tells
+        if the first line starts in the split, the range itself and the rest of the line crossing its end, if any.
+        :return: hex digest, splits of an appended file keep their fingerprints except the last one
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        with open(self.path, 'rb') as f:
+            f.seek(max(self.start - 1, 0))
+            remaining = self.end - f.tell()
+            block = b''
+            while remaining > 0:
+                block = f.read(min(block_size, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                remaining -= len(block)
+            if not block.endswith(b'\n'):
+                digest.update(f.readline())
+        return digest.hexdigest()
+
+    def __str__(self):
+        return "bytes between {0} and {1} of {2}".format(self.start, self.end, self.path)
+
+
+class DatasetSplit(object):
+    """
+    A chunk of a dataset file (see dataset.py), read by the worker iterating over the split, through
+    a memory map if the dataset isn't compressed. Records are Python values, tuples for structured records.
+    """
+    def __init__(self, path, chunk):
+        self.path = path
+        self.chunk = chunk
+
+    def __iter__(self):
+        return iter(Dataset(self.path).chunk(self.chunk).tolist())
+
+    def fingerprint(self):
+        """
+        :return: hex digest of the type and the shape of the records and of the stored bytes of the chunk
+        """
+        dataset = Dataset(self.path)
+        digest = hashlib.blake2b(dataset.raw_chunk(self.chunk), digest_size=16)
+        # the same bytes are other records in a dataset of another type, descr tells the fields of structured ones
+        digest.update(repr((dataset.dtype.str, dataset.dtype.descr, dataset.shape[1:])).encode())
+        return digest.hexdigest()
+
+    def __str__(self):
+        return "chunk {0} of {1}".format(self.chunk, self.path)
+
+
+def file_splits(path, num_splits, split_bytes):
+    """
+    Splits a file into byte ranges of at most split_bytes, and at least num_splits of them
+    if the file is large enough.
+    """
+    file_size = os.path.getsize(path)
+    size = max(min(split_bytes, -(-file_size // num_splits)), 1)
+    for start in range(0, file_size, size):
+        yield FileSplit(path, start, min(start + size, file_size))
+
+
+def make_splits(input, num_splits, split_bytes, split_records):
+    """
+    Generates splits of input for map tasks.
+    :param input: path to a text file, a dataset.Dataset, a list (or any sliceable sequence) or any other iterable
+    :param num_splits: number of chunks a sequence is split into
+    :param split_bytes: maximum size of a file split in bytes
+    :param split_records: number of records in a split of an iterable which isn't a sequence
+    :return: generator of splits, iterables are consumed lazily as splits are requested
+    """
+    if isinstance(input, (str, bytes, os.PathLike)):
+        yield from file_splits(input, num_splits, split_bytes)
+    elif isinstance(input, Dataset):
+        # a chunk is a split, the chunk length of the dataset sets the size of map tasks
+        for chunk in range(input.num_chunks):
+            yield DatasetSplit(input.path, chunk)
+    elif hasattr(input, '__len__') and hasattr(input, '__getitem__'):
+        chunksize = max(-(-len(input) // num_splits), 1)
+        for id_start in range(0, len(input), chunksize):
+            yield RecordSplit(input[id_start:id_start + chunksize], id_start)
+    else:
+        iterator = iter(input)
+        id_start = 0
+        while True:
+            records = list(itertools.islice(iterator, split_records))
+            if not records:
+                break
+            yield RecordSplit(records, id_start)
+            id_start += len(records)
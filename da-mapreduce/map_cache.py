@@ -0,0 +1,132 @@
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+
+
+def function_identity(function):
+    """
+    Identifies a mapper or a combiner across runs by its qualified name and its code,
+    so that cached outputs of a function are not used once the function is changed.
+    Only the code of the function itself is hashed: the values of the globals and of the closure variables
+    it reads, and the functions it calls, are not. Clear the cache or rename the function when they change.
+    """
+    if function is None:
+        return 'None'
+    name = '{0}.{1}'.format(getattr(function, '__module__', ''), getattr(function, '__qualname__', repr(function)))
+    code = getattr(function, '__code__', None)
+    if code is None:
+        return name
+    digest = hashlib.blake2b(code.co_code, digest_size=16)
+    digest.update(repr((code.co_names, [const for const in code.co_consts if not hasattr(const, 'co_code')])).encode())
+    return '{0}:{1}'.format(name, digest.hexdigest())
+
+
+class MapOutputCache(object):
+    """
+    Keeps combined and partitioned outputs of map tasks on disk, keyed by the fingerprint of the input split
+    and the identity of the job, so that a rerun of a job over a mostly unchanged input maps only the new
+    and changed splits. Every entry is a directory with the pickled partitions and their spilled run files.
+    The least recently used entries are evicted when the cache grows over max_bytes, the time of the last
+    use is kept as the modification time of the entry, so it is shared by all the processes using the cache.
+    """
+    def __init__(self, directory, max_bytes=2 ** 30):
+        """
+        :param directory: directory of the cache, it is created if it doesn't exist
+        :param max_bytes: size of the cache on disk above which the least recently used entries are removed
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(split, identity):
+        """
+        :param split: split with a fingerprint() method, see input_splits
+        :param identity: string identifying everything else the map output depends on
+        :return: key of the map output of the split
+        """
+        return hashlib.blake2b('{0}/{1}'.format(identity, split.fingerprint()).encode(), digest_size=20).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, spill_dir):
+        """
+        Loads cached map output, its run files are linked into spill_dir, where the reduce may remove them.
+        :return: list of Partition or None if the key isn't cached
+        """
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, 'partitions.pkl'), 'rb') as f:
+                partitions = pickle.load(f)
+            os.utime(path)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        for partition in partitions:
+            for i, run in enumerate(partition):
+                if isinstance(run, str):
+                    partition[i] = self._copy(os.path.join(path, run), spill_dir)
+        self.hits += 1
+        return partitions
+
+    @staticmethod
+    def _copy(path, directory):
+        """
+        Hard links the file into the directory, copies it if the directory is on another file system.
+        :return: path of the new file
+        """
+        fd, target = tempfile.mkstemp(suffix='.run', dir=directory)
+        os.close(fd)
+        os.remove(target)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copyfile(path, target)
+        return target
+
+    def put(self, key, partitions):
+        """
+        Stores map output, run files are linked into the entry, so the reduce may remove the originals.
+        The entry is written to a temporary directory and renamed, readers never see it half written.
+        """
+        entry = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        stored = []
+        for partition in partitions:
+            runs = [os.path.basename(self._copy(run, entry)) if isinstance(run, str) else run for run in partition]
+            stored.append(type(partition)(runs, partition.weight, partition.key_sizes))
+        with open(os.path.join(entry, 'partitions.pkl'), 'wb') as f:
+            pickle.dump(stored, f, pickle.HIGHEST_PROTOCOL)
+        try:
+            os.rename(entry, self._path(key))
+        except OSError:
+            # another run has stored the same output meanwhile
+            shutil.rmtree(entry, ignore_errors=True)
+        self.evict()
+
+    @staticmethod
+    def _size(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and not entry.name.startswith('.'):
+                entries.append((entry.stat().st_mtime, self._size(entry.path), entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
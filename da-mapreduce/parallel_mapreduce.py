@@ -1,134 +1,495 @@
 import collections
+import heapq
 import math
 import multiprocessing
+import numbers
+import operator
+import os
+import pickle
+import shutil
+import struct
+import tempfile
 import time
+import zlib
 
+import dataset
+import executors
+import tracing
+from input_splits import make_splits
+from map_cache import function_identity
+from scheduler import TaskScheduler
+from spill import merge_runs, write_run
 
-class MapReduce(object):
-    def __init__(self, the_mapper, the_reducer):
+
+def _key_bytes(key):
+    """
+    Encodes the key so that equal keys give equal bytes in every process. Hash of str and bytes is salted
+    per process and hash of None and of plain objects depends on their address, so hash of a tuple
+    holding any of them differs between workers too.
+    """
+    if isinstance(key, str):
+        return b's' + key.encode('utf-8', 'surrogatepass')
+    if isinstance(key, bytes):
+        return b'b' + key
+    if isinstance(key, numbers.Number):
+        # hash of numbers isn't salted and equal numbers of any type, like 1, 1.0 and np.int64(1), share it
+        return b'n%d' % hash(key)
+    if key is None:
+        return b'N'
+    if isinstance(key, (tuple, frozenset)):
+        items = [_key_bytes(item) for item in key]
+        if isinstance(key, frozenset):
+            items.sort()
+        return (b't' if isinstance(key, tuple) else b'f') + b''.join(struct.pack('<I', len(item)) + item
+                                                                      for item in items)
+    return b'p' + pickle.dumps(key, 4)
+
+
+def _partition(key, num_partitions):
+    """
+    Picks the reduce partition of the key, the same one in every worker, whatever the start method
+    of the processes or the machine they run on.
+    """
+    if isinstance(key, numbers.Number):
+        return hash(key) % num_partitions
+    return zlib.crc32(_key_bytes(key)) % num_partitions
+
+
+def _apply_reducer(the_reducer, items):
+    """
+    Applies the reducer to every (key, values) pair and returns a new dict with the results.
+    """
+    output = {}
+    for key, value in items:
+        if key not in output:
+            output[key] = 0
+        the_reducer(key, value, output)
+    return output
+
+
+class Partition(list):
+    """
+    Runs of one reduce partition collected from all map tasks, together with the number of values
+    in them (weight) and the sizes of the heaviest keys sampled by the map tasks.
+    """
+    def __init__(self, runs=(), weight=0, key_sizes=None):
+        super(Partition, self).__init__(runs)
+        self.weight = weight
+        self.key_sizes = key_sizes if key_sizes is not None else collections.Counter()
+
+
+class WorkerPool(object):
+    """
+    Owns a pool of workers which is started lazily and reused by all the jobs run through it
+    until close() is called. Workers are processes, threads or the calling process itself,
+    depending on the backend (see executors.BACKENDS), or worker daemons of a distributed.RemotePool.
+    """
+    def __init__(self, num_workers=None, backend='process', scheduler=None):
+        """
+        :param num_workers: size of the worker pool, defaults to number of CPUs or to the size of the backend pool
+        :param backend: 'serial', 'thread', 'process' or 'auto' to pick the backend and the number of workers
+                        for every job from the size of its input (see executors.choose_backend).
+                        It can also be a pool object like distributed.RemotePool, which is used as it is
+                        and not closed by close()
+        :param scheduler: TaskScheduler which retries failed tasks and starts backups of stragglers,
+                          one with the default settings if None
+        """
+        self.num_workers = num_workers or getattr(backend, 'num_workers', None) or multiprocessing.cpu_count()
+        self.backend = backend
+        self.scheduler = scheduler if scheduler is not None else TaskScheduler()
+        # (backend, number of workers) -> pool, 'auto' may use several of them
+        self._pools = {}
+        self._pool = None
+
+    def __getstate__(self):
+        # the pools belong to the process which started them and can't be pickled,
+        # workers only need the user functions
+        state = self.__dict__.copy()
+        state['_pools'] = {}
+        state['_pool'] = None
+        if not isinstance(self.backend, str):
+            state['backend'] = None
+        return state
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self, backend=None, num_workers=None):
+        """
+        Starts the worker pool of the backend, the configured one by default. It is reused by map, reduce
+        and all the following jobs until close() is called. With the 'auto' backend pools are started
+        when a job picks them.
+        :param backend: 'serial', 'thread' or 'process'
+        :param num_workers: size of the pool, num_workers by default
+        """
+        backend = backend or self.backend
+        if backend == 'auto':
+            return self
+        if not isinstance(backend, str):
+            self._pool = backend
+            return self
+        key = backend, num_workers or self.num_workers
+        if key not in self._pools:
+            with tracing.span('spawn', 'pool', backend=key[0], workers=key[1]):
+                self._pools[key] = executors.make_pool(*key)
+        self._pool = self._pools[key]
+        return self
+
+    def close(self):
+        """
+        Waits for the workers to finish and shuts the pools down, pools with lost or hung tasks are terminated.
+        """
+        for pool in self._pools.values():
+            executors.shutdown(pool, pool in self.scheduler.stuck_pools)
+            self.scheduler.stuck_pools.discard(pool)
+        self._pools = {}
+        self.scheduler.close()
+        self._pool = None
+
+    def _estimate_work(self, inputs):
+        """
+        :return: estimated time in seconds the job takes serially, infinity if it isn't known
+        """
+        return float('inf')
+
+    def _choose_backend(self, inputs, gil_free=False):
+        """
+        With the 'auto' backend picks the pool of the next job: small inputs are processed serially,
+        large ones by as many workers as pay off their overhead.
+        :param gil_free: True if tasks release the GIL, so that threads can run them in parallel
+        """
+        if self.backend != 'auto':
+            return
+        backend, num_workers = executors.choose_backend(self._estimate_work(inputs), self.num_workers, gil_free)
+        print("Running on {0} backend with {1} workers".format(backend, num_workers))
+        self.start(backend, num_workers)
+
+    def _run_tasks(self, target, tasks, verbose=False):
+        """
+        Submits tasks to the pool through the scheduler and blocks until every one of them is done.
+        Tasks are taken lazily, at most two per worker are in progress at a time, so a generator
+        of tasks is never materialized. Failed, lost and straggling tasks are re-executed, the exception
+        of a task which fails on every attempt is re-raised here.
+        :return: list of task results in the order of tasks
+        """
+        if self._pool is None:
+            self.start('process' if self.backend == 'auto' else None)
+        return self.scheduler.run(self._pool, target, tasks, 2 * self.num_workers, verbose)
+
+
+class MapReduce(WorkerPool):
+    # mappers and reducers are Python code holding the GIL, threads wouldn't run them in parallel
+    gil_free = False
+
+    def __init__(self, the_mapper, the_reducer, num_workers=None, the_combiner=None,
+                 spill_threshold=None, spill_dir=None, split_bytes=64 * 2 ** 20, split_records=2 ** 16,
+                 buckets_per_worker=4, sampled_keys=8, backend='process', scheduler=None, cache=None):
         """
         :param the_mapper: the mapper specified by user of the class
         :param the_reducer: the reducer specified by user of the class
+        :param num_workers: size of the worker pool, defaults to number of CPUs
+        :param the_combiner: optional reducer-like function which is applied to the output of
+                             each mapper locally before the shuffle
+        :param spill_threshold: number of records a map task processes before its buffer is spilled
+                                to a sorted run on disk, if None map output is kept in memory
+        :param spill_dir: directory for spilled runs, system temporary directory by default
+        :param split_bytes: maximum size in bytes of a split of an input file
+        :param split_records: number of records in a split of an input iterator
+        :param buckets_per_worker: map output is hash partitioned into this many buckets per reduce task,
+                                   which are then packed into reduce tasks by weight
+        :param sampled_keys: number of the heaviest keys every map task reports per partition
+                             to detect hot keys
+        :param backend: 'serial', 'thread', 'process', 'auto' to pick it for every job from the size of the input
+                        or a pool object like distributed.RemotePool
+        :param scheduler: TaskScheduler of map and reduce tasks, see WorkerPool
+        :param cache: map_cache.MapOutputCache, if given the map output of every split is kept in it and the next
+                      jobs map only the splits which are not cached. Inputs are then cut into splits of fixed size,
+                      split_bytes of a file or split_records of a list, so that appending to the input
+                      leaves the splits before the end unchanged
         """
+        super(MapReduce, self).__init__(num_workers, backend, scheduler)
         self.the_mapper = the_mapper
         self.the_reducer = the_reducer
+        self.the_combiner = the_combiner
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+        self.split_bytes = split_bytes
+        self.split_records = split_records
+        self.buckets_per_worker = buckets_per_worker
+        self.sampled_keys = sampled_keys
+        self.cache = cache
+        self.reduce_timings = []
 
-    def _mapper(self, input, output, length, worker_number, chunksize):
+    def _estimate_work(self, inputs, sample_size=64):
+        """
+        Times the mapper on the first records of the inputs, reduce is assumed to take as long as map.
+        :return: estimated time in seconds the job takes serially, infinity for iterators and files
+        """
+        if isinstance(inputs, (str, os.PathLike)) or not hasattr(inputs, '__getitem__'):
+            return float('inf')
+        sample = inputs[:sample_size]
+        if not len(sample):
+            return 0.0
+        output = collections.defaultdict(list)
+        start = time.perf_counter()
+        for input_el in sample:
+            self.the_mapper(input_el, output)
+        return 2 * (time.perf_counter() - start) * len(inputs) / len(sample)
+
+    def _combine_and_partition(self, output, num_partitions):
+        """
+        Applies the combiner to the buffer of a map task and splits it into partitions.
+        """
+        if self.the_combiner is not None:
+            combined = _apply_reducer(self.the_combiner, output.items())
+            output = {key: [value] for key, value in combined.items()}
+        partitions = [{} for _ in range(num_partitions)]
+        for key, value in output.items():
+            partitions[_partition(key, num_partitions)][key] = value
+        return partitions
+
+    def _mapper(self, split, worker_number, num_partitions, spill_dir):
         """
         Implements map part which is done by each Worker(Process) in parallel.
+
+        The mapper emits into a buffer local to the process, which is combined (if combiner is given)
+        and split into num_partitions dicts so that every key goes to exactly one reducer.
+        If spill_dir is given the buffer is written to sorted runs on disk every spill_threshold records.
+        :return: Partition per partition index: runs, each is a dict(key, values) or a path to a run file,
+                 the number of values in them and the sizes of the heaviest keys
         """
         print("Thread {0} is working".format(worker_number))
-        id_start = worker_number * chunksize
-        id_end = min((worker_number + 1) * chunksize, length)
-        print("It processes indexes of input array between {0} and {1}".format(id_start, id_end))
-        for i in range(length)[id_start:id_end]:
-            if input[i] in output:
-                self.the_mapper(input[i],output)
+        print("It processes {0}".format(split))
+        partitions = [Partition() for _ in range(num_partitions)]
+        output = collections.defaultdict(list)
+        buffered = 0
+        for input_el in split:
+            self.the_mapper(input_el, output)
+            buffered += 1
+            if spill_dir is not None and buffered >= self.spill_threshold:
+                self._flush(output, partitions, spill_dir)
+                output = collections.defaultdict(list)
+                buffered = 0
+        self._flush(output, partitions, spill_dir)
+        return partitions
+
+    def _flush(self, output, partitions, spill_dir):
+        """
+        Moves the buffer of a map task to the runs of its partitions, writing them to disk if spill_dir is given.
+        """
+        for partition, buffer in zip(partitions, self._combine_and_partition(output, len(partitions))):
+            if not buffer:
+                continue
+            sizes = [(key, len(value)) for key, value in buffer.items()]
+            partition.weight += sum(size for _, size in sizes)
+            partition.key_sizes.update(dict(heapq.nlargest(self.sampled_keys, sizes, key=operator.itemgetter(1))))
+            partition.append(write_run(buffer, spill_dir) if spill_dir is not None else buffer)
+
+    def _uncached_splits(self, splits, num_partitions, spill_dir, cached, missed):
+        """
+        Looks the splits up in the cache and generates only the ones which have to be mapped.
+        Cached run files are linked into spill_dir of the job.
+        :param cached: dict which gets the cached map output by index of the split
+        :param missed: list which gets (index of the split, cache key) of every generated split
+        :return: generator of (index of the split, split)
+        """
+        identity = '{0}/{1}/{2}/{3}'.format(function_identity(self.the_mapper), function_identity(self.the_combiner),
+                                            num_partitions, self.spill_threshold is not None)
+        for i, split in enumerate(splits):
+            key = self.cache.key(split, identity)
+            output = self.cache.get(key, spill_dir)
+            if output is None:
+                missed.append((i, key))
+                yield i, split
             else:
-                output[input[i]] = []
-                self.the_mapper(input[i], output)
+                cached[i] = output
+
+    @staticmethod
+    def _shuffle(map_outputs, num_partitions):
+        """
+        Collects partition p of every map task into a single Partition for reducer p.
+        """
+        partitions = []
+        for p in range(num_partitions):
+            partition = Partition()
+            for map_output in map_outputs:
+                partition += map_output[p]
+                partition.weight += map_output[p].weight
+                partition.key_sizes.update(map_output[p].key_sizes)
+            partitions.append(partition)
+        return partitions
 
     def map_parallel(self, input, num_threads=4, verbose=False):
         """
-        A standard map part of MapReduce job. The work is done in num_workers threads
-        as much in parallel as Python multiprocessing allows.
-        :param input: list of values
-        :param num_threads: number of threads to handle work
-        :return: result of applying _mapper in form of (key, value). Keys are sorted in ascending order
-        """
-        input_len = len(input)
-        input_dict = multiprocessing.Manager().dict(enumerate(input))
-        output_dict = multiprocessing.Manager().dict()
-        chunksize = math.ceil(input_len / num_threads)
-
-        # Create the threads.
-        threads = []
-        # Start the threads.
-        for i in range(num_threads):
-            t = multiprocessing.Process(target=self._mapper, args=(input_dict, output_dict, input_len, i, chunksize))
-            threads.append(t)
-            t.start()
-            # I've introduced delay as otherwise my processed didn't want to wait for each other correctly
-            # as a result not all the values were processed
-            time.sleep(1)
-            if verbose:
-                print("Current state of output array:")
-                print("{" + "\n".join("{}: {}".format(k, v) for k, v in output_dict.items()) + "}")
-        # Wait for the threads to finish.
-        for t in threads:
-            t.join()
-        for t in threads:
-            t.terminate()
-        ordered_dict = collections.OrderedDict(sorted(output_dict.items()))
-        return ordered_dict
-
-    def _reducer(self, input, output, input_keys, worker_number, chunksize):
+        A standard map part of MapReduce job. The input is split into chunks which are handled
+        by the worker pool as much in parallel as Python multiprocessing allows.
+        :param input: list of values, any other iterable, path to a text file with a record per line
+                      or a dataset.Dataset, whose chunks are the splits. Iterables and files are read lazily
+                      split by split.
+        :param num_threads: number of chunks a list is split into, also the number of reduce tasks
+        :return: list of Partition - runs of the partition, dict(key, values) or path to a sorted run file
+                 spilled by a map task. There are buckets_per_worker partitions per reduce task.
+        """
+        spill_dir = None
+        if self.spill_threshold is not None:
+            spill_dir = tempfile.mkdtemp(prefix='mapreduce-', dir=self.spill_dir)
+        num_partitions = num_threads * self.buckets_per_worker
+        if self.cache is None:
+            splits = enumerate(make_splits(input, num_threads, self.split_bytes, self.split_records))
+        else:
+            # splits of fixed size, a list is split like an iterator
+            fixed = isinstance(input, (str, bytes, os.PathLike, dataset.Dataset))
+            splits = make_splits(input if fixed else iter(input), 1, self.split_bytes, self.split_records)
+            cached, missed = {}, []
+            splits = self._uncached_splits(splits, num_partitions, spill_dir, cached, missed)
+        tasks = ((split, i, num_partitions, spill_dir) for i, split in splits)
+        with tracing.span('map', 'mapreduce'):
+            map_outputs = self._run_tasks(self._mapper, tasks, verbose)
+        if self.cache is not None:
+            with tracing.span('cache map output', 'mapreduce', splits=len(missed)):
+                for (i, key), map_output in zip(missed, map_outputs):
+                    self.cache.put(key, map_output)
+                    cached[i] = map_output
+            print("Map output of {0} of {1} splits is taken from the cache".format(len(cached) - len(missed),
+                                                                                  len(cached)))
+            map_outputs = [cached[i] for i in sorted(cached)]
+        if spill_dir is not None and not os.listdir(spill_dir):
+            os.rmdir(spill_dir)
+        with tracing.span('shuffle', 'mapreduce', partitions=num_partitions):
+            return self._shuffle(map_outputs, num_partitions)
+
+    def _reducer(self, input, worker_number, partial=False):
         """
         Implements reduce part which is done by each Worker(Process) in parallel.
 
-        As keys of input are sorted, allocating data each Worker an equal number of
-        indices which are taken sequentially makes sense as will always send the same key to the same
-        reducer
+        Input is a list of runs produced by map tasks for one partition, values of the same key
+        are grouped before the reducer is applied. Spilled runs are merged from disk as sorted streams.
+        If partial is True, the combiner is applied instead of the reducer - the runs hold a part
+        of the values of a hot key which is split between several tasks.
         """
         print("Thread {0} is working".format(worker_number))
-        id_start = worker_number * chunksize
-        id_end = min((worker_number + 1) * chunksize, len(input_keys))
-        print("It processes keys: ", input_keys[id_start: id_end])
-        for key in input_keys[id_start:id_end]:
-            if key in output:
-                self.the_reducer(key, input[key], output)
+        the_reducer = self.the_combiner if partial else self.the_reducer
+        if all(isinstance(run, dict) for run in input):
+            grouped = collections.defaultdict(list)
+            for run in input:
+                for key, value in run.items():
+                    grouped[key] += value
+            print("It processes keys: ", sorted(grouped.keys()))
+            return _apply_reducer(the_reducer, grouped.items())
+        print("It merges {0} runs".format(len(input)))
+        # runs are removed with the spill directory after the reduce, so the task can be re-executed
+        return _apply_reducer(the_reducer, merge_runs(input))
+
+    def _reduce_task(self, input, worker_number, partial):
+        """
+        Runs _reducer and measures how long it took.
+        :return: (output of _reducer, time spent in seconds)
+        """
+        start = time.perf_counter()
+        output = self._reducer(input, worker_number, partial)
+        return output, time.perf_counter() - start
+
+    def _plan_reduce(self, partitions, num_threads):
+        """
+        Builds reduce tasks balanced by the weight (number of values) sampled by map tasks.
+
+        Keys heavier than the fair share of a task are hot: if there is a combiner and their runs are in memory,
+        they are taken out of their partition and their runs are split between several partial tasks,
+        whose results are reduced in the end. The other partitions are packed into num_threads tasks,
+        heaviest first into the lightest task.
+        :return: list of (runs, weight, partial) sorted by weight descending, so that workers which are done
+                 with their task take the lighter leftover tasks from the queue of the pool
+        """
+        target = sum(partition.weight for partition in partitions) / num_threads
+        tasks = []
+        buckets = []
+        for partition in partitions:
+            weight = partition.weight
+            if self.the_combiner is not None and all(isinstance(run, dict) for run in partition):
+                for key, size in partition.key_sizes.items():
+                    if size <= target:
+                        continue
+                    key_runs = [{key: run.pop(key)} for run in partition if key in run]
+                    weight -= size
+                    pieces = min(len(key_runs), max(math.ceil(size / target), 2))
+                    for piece in range(pieces):
+                        piece_runs = key_runs[piece::pieces]
+                        tasks.append((piece_runs, sum(len(run[key]) for run in piece_runs), True))
+            runs = [run for run in partition if run]
+            if runs:
+                buckets.append((weight, runs))
+        bins = [[0, []] for _ in range(num_threads)]
+        for weight, runs in sorted(buckets, key=operator.itemgetter(0), reverse=True):
+            lightest = min(bins, key=operator.itemgetter(0))
+            lightest[0] += weight
+            lightest[1] += runs
+        tasks += [(runs, weight, False) for weight, runs in bins if runs]
+        return sorted(tasks, key=operator.itemgetter(1), reverse=True)
+
+    def reduce_parallel(self, partitions, num_threads=4, verbose=False):
+        """
+        A standard reduce part of MapReduce job. Partitions are packed by weight into num_threads tasks, hot keys
+        are split between extra tasks, which are handled by the worker pool as much in parallel
+        as Python multiprocessing allows. Weight and time of every task are printed and kept in reduce_timings.
+        :param partitions: result of map_parallel - a list of Partition
+        :param num_threads: number of reduce tasks partitions are packed into
+        :return: result of applying _reducer in form of (key, value). Keys are sorted in ascending order
+        """
+        with tracing.span('plan reduce', 'mapreduce'):
+            tasks = self._plan_reduce(partitions, num_threads)
+        output_dict = {}
+        partials = collections.defaultdict(list)
+        self.reduce_timings = []
+        with tracing.span('reduce', 'mapreduce', tasks=len(tasks)):
+            results = self._run_tasks(self._reduce_task, [(runs, i, partial)
+                                                          for i, (runs, _, partial) in enumerate(tasks)], verbose)
+        for (runs, weight, partial), (reduce_output, elapsed) in zip(tasks, results):
+            print("Reduce task {0}{1}: {2} values in {3:.6f} s".format(
+                len(self.reduce_timings), " (partial)" if partial else "", weight, elapsed))
+            self.reduce_timings.append((weight, elapsed))
+            if partial:
+                for key, value in reduce_output.items():
+                    partials[key].append(value)
             else:
-                output[key] = 0
-                self.the_reducer(key, input[key], output)
-
-    def reduce_parallel(self, input_dict, num_threads=4, verbose=False):
-        """
-        A standard reduce part of MapReduce job. The work is done in num_workers threads
-        as much in parallel as Python multiprocessing allows.
-        :param input_dict: result of map - dict(key,value) where keys are sorted in ascending order
-        :param num_threads: number of threads to handle work
-        :return: result of applying _reducer in form of (key, value)
-        """
-        input_keys = [*input_dict.keys()]
-        input_dict = multiprocessing.Manager().dict(input_dict)
-        output_dict = multiprocessing.Manager().dict()
-        chunksize = math.ceil(len(input_keys) / num_threads)
-        # Create the threads.
-        threads = []
-        # Start the threads.
-        for i in range(num_threads):
-            t = multiprocessing.Process(target=self._reducer, args=(input_dict, output_dict, input_keys, i, chunksize))
-            threads.append(t)
-            t.start()
-            # I've introduced delay as otherwise my processed didn't want to wait for each other correctly
-            # as a result not all the values were processed
-            time.sleep(1)
-            if verbose:
-                print("Current state of output array:")
-                print("{" + "\n".join("{}: {}".format(k, v) for k, v in output_dict.items()) + "}")
-        # Wait for the threads to finish.
-        for t in threads:
-            t.join()
-        for t in threads:
-            t.terminate()
+                output_dict.update(reduce_output)
+        output_dict.update(_apply_reducer(self.the_reducer, partials.items()))
+        for spill_dir in {os.path.dirname(run) for partition in partitions for run in partition
+                          if isinstance(run, str)}:
+            shutil.rmtree(spill_dir, ignore_errors=True)
         ordered_tuple = collections.OrderedDict(sorted(output_dict.items()))
         return ordered_tuple.items()
 
-    def __call__(self, inputs, num_workers, verbose=False):
+    @staticmethod
+    def _write_output(result, path):
+        """
+        Writes the result of the job to a dataset file as (key, value) records.
+        """
+        dataset.write_pairs(path, result)
+
+    def __call__(self, inputs, num_workers, verbose=False, output=None):
         """
         Processes the inputs through the map and reduce functions given.
-        :param inputs: an iterable containing the input data to be processed.
-        :param num_workers: number of threads to handle both map and reduce specified by user
+        :param inputs: an iterable containing the input data to be processed, path to a text file
+                       or a dataset.Dataset
+        :param num_workers: number of chunks to split the work of both map and reduce into
         :param verbose: allows to restrict verbosity of the algorithm, if False - less is printed in logs
+        :param output: optional path to a dataset file the result is written to
         :return: reduced values: result of MapReduce job
         """
+        self._choose_backend(inputs, self.gil_free)
         print("Map is running...")
         map_responses = self.map_parallel(inputs, num_workers, verbose)
         if verbose:
             print("Map response")
-            print("{" + "\n".join("{}: {}".format(k, v) for k, v in map_responses.items()) + "}")
+            print("\n".join("Partition {}: {}".format(p, partition) for p, partition in enumerate(map_responses)))
         print("Map is finished.")
         print("Reduce is running...")
         reduced_values = self.reduce_parallel(map_responses, num_workers, verbose)
         print("Reduce is finished.")
+        if output is not None:
+            with tracing.span('write output', 'mapreduce'):
+                self._write_output(reduced_values, output)
         return reduced_values
@@ -0,0 +1,185 @@
+import itertools
+import shutil
+import tempfile
+
+import tracing
+from input_splits import make_splits
+from parallel_mapreduce import MapReduce, WorkerPool
+
+
+def _name(function):
+    return getattr(function, '__name__', repr(function))
+
+
+class _FusedSplit(object):
+    """
+    Records of a split passed lazily through a chain of fused map and filter stages.
+    """
+    def __init__(self, records, ops):
+        self.records = records
+        self.ops = ops
+
+    def __iter__(self):
+        records = iter(self.records)
+        for kind, function in self.ops:
+            if kind == 'map':
+                records = itertools.chain.from_iterable(map(function, records))
+            else:
+                records = filter(function, records)
+        return records
+
+    def __str__(self):
+        if not self.ops:
+            return str(self.records)
+        return "{0} through {1} fused map stages".format(self.records, len(self.ops))
+
+
+class Step(object):
+    """
+    A step of the job plan: map-only stages fused into a single pass, followed by a MapReduce
+    stage (if any). A step ends at a shuffle.
+    """
+    def __init__(self, ops, job=None):
+        self.ops = ops
+        self.job = job
+
+    def __str__(self):
+        names = [_name(function) for _, function in self.ops]
+        if self.job is not None:
+            names.append("map_reduce({0}, {1})".format(_name(self.job.the_mapper), _name(self.job.the_reducer)))
+        return " -> ".join(names)
+
+
+class Pipeline(WorkerPool):
+    """
+    Chains map, filter and MapReduce stages. Adjacent map-only stages are fused into one pass, they run
+    in the map tasks of the next MapReduce stage or, after the last one, in its reduce tasks. Reduce tasks
+    of a stage run the map side of the next stage on their output, so no separate map tasks are run between
+    stages. The shuffle goes through the calling process: every task returns its partitions as its result,
+    and the calling process groups them and sends every group to a reduce task of the next stage.
+    In-memory partitions are pickled both ways, with a spill_threshold the partitions which are spilled
+    to disk are passed as paths of their run files, so only the unspilled part of the data goes through
+    the calling process. The output of the last stage is returned to it as a list.
+    """
+    def __init__(self, num_workers=None, split_bytes=64 * 2 ** 20, split_records=2 ** 16, backend='process',
+                 scheduler=None):
+        """
+        :param num_workers: size of the worker pool, defaults to number of CPUs
+        :param split_bytes: maximum size in bytes of a split of an input file
+        :param split_records: number of records in a split of an input iterator
+        :param backend: 'serial', 'thread' or 'process', 'auto' runs on processes as the cost of the stages
+                        isn't known in advance
+        :param scheduler: TaskScheduler of the tasks of all stages, see WorkerPool
+        """
+        super(Pipeline, self).__init__(num_workers, backend, scheduler)
+        self.stages = []
+        self.split_bytes = split_bytes
+        self.split_records = split_records
+
+    def map(self, function):
+        """
+        Adds a map-only stage: function(record) returns an iterable of output records.
+        """
+        self.stages.append(('map', function))
+        return self
+
+    def filter(self, predicate):
+        """
+        Adds a stage which keeps the records for which predicate(record) is true.
+        """
+        self.stages.append(('filter', predicate))
+        return self
+
+    def map_reduce(self, the_mapper, the_reducer, the_combiner=None, spill_threshold=None):
+        """
+        Adds a MapReduce stage, the mapper and reducer have the same contract as in MapReduce.
+        The stage outputs (key, value) records.
+        """
+        self.stages.append(('map_reduce', MapReduce(the_mapper, the_reducer, num_workers=1,
+                                                    the_combiner=the_combiner, spill_threshold=spill_threshold)))
+        return self
+
+    def plan(self):
+        """
+        Fuses the stages into steps, each step ends with a MapReduce stage except maybe the last one.
+        :return: list of Step
+        """
+        steps = []
+        ops = []
+        for kind, stage in self.stages:
+            if kind == 'map_reduce':
+                steps.append(Step(ops, stage))
+                ops = []
+            else:
+                ops.append((kind, stage))
+        if ops or not steps:
+            steps.append(Step(ops))
+        return steps
+
+    @staticmethod
+    def _map_side(records, step, worker_number, num_partitions, spill_dir):
+        """
+        Passes records through the fused map-only stages of the step and the map side of its MapReduce stage.
+        :return: list of records if the step is map-only, otherwise list of runs per partition
+        """
+        fused = _FusedSplit(records, step.ops)
+        if step.job is None:
+            return list(fused)
+        if step.job.spill_threshold is None:
+            spill_dir = None
+        return step.job._mapper(fused, worker_number, num_partitions, spill_dir)
+
+    def _map_task(self, split, step, worker_number, num_partitions, spill_dir):
+        """
+        Runs the first step over a split of the input.
+        """
+        if step.job is None:
+            print("Thread {0} is working".format(worker_number))
+            print("It processes {0}".format(split))
+        return self._map_side(split, step, worker_number, num_partitions, spill_dir)
+
+    def _reduce_task(self, partition, step, next_step, worker_number, num_partitions, spill_dir):
+        """
+        Runs the reduce side of the step and passes its output through the next step: its fused
+        map-only stages and the map side of its MapReduce stage.
+        """
+        output = step.job._reducer(partition, worker_number)
+        if next_step is None:
+            return list(output.items())
+        return self._map_side(output.items(), next_step, worker_number, num_partitions, spill_dir)
+
+    def __call__(self, inputs, num_workers, verbose=False):
+        """
+        Runs the pipeline over the inputs.
+        :param inputs: list of values, any other iterable or path to a text file with a record per line
+        :param num_workers: number of chunks a list is split into, also the number of partitions of every shuffle
+        :param verbose: allows to restrict verbosity of the algorithm, if False - less is printed in logs
+        :return: list of output records of the last stage, sorted by key if it is a MapReduce stage
+        """
+        steps = self.plan()
+        print("Plan: " + " | ".join(str(step) for step in steps))
+        spill_dir = tempfile.mkdtemp(prefix='pipeline-')
+        try:
+            splits = make_splits(inputs, num_workers, self.split_bytes, self.split_records)
+            tasks = ((split, steps[0], i, num_workers, spill_dir) for i, split in enumerate(splits))
+            with tracing.span('map', 'pipeline'):
+                outputs = self._run_tasks(self._map_task, tasks, verbose)
+            for s, step in enumerate(steps):
+                if step.job is None:
+                    # only the first step can be map-only, later ones are fused into the reduce before them
+                    break
+                print("Stage {0} is running...".format(s))
+                # shuffle: partition p of every task goes to reducer p
+                with tracing.span('shuffle', 'pipeline', stage=s):
+                    partitions = step.job._shuffle(outputs, num_workers)
+                next_step = steps[s + 1] if s + 1 < len(steps) else None
+                tasks = [(partition, step, next_step, p, num_workers, spill_dir)
+                         for p, partition in enumerate(partitions) if partition]
+                with tracing.span('reduce', 'pipeline', stage=s):
+                    outputs = self._run_tasks(self._reduce_task, tasks, verbose)
+            records = [record for output in outputs for record in output]
+            if steps[-1].job is not None:
+                return sorted(records, key=lambda record: record[0])
+            return records
+        finally:
+            shutil.rmtree(spill_dir, ignore_errors=True)
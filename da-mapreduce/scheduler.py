@@ -0,0 +1,354 @@
+import atexit
+import collections
+import itertools
+import os
+import queue
+import statistics
+import struct
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import executors
+import tracing
+
+_BEAT = struct.Struct('d')
+
+_attach_lock = threading.Lock()
+
+
+def _attach_shared_memory(name):
+    """
+    Attaches to an existing shared memory block without registering it with the resource tracker,
+    which would unlink the block when the attaching worker exits: the process which created
+    the block is responsible for unlinking it.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # tasks run by a thread executor attach concurrently, the patch must not be interleaved
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class _Heart(object):
+    """
+    Writes the heartbeats of the attempts running in a worker process: a single thread writes the time
+    to the slots of all of them every interval seconds. The board of the last run stays attached,
+    so that the next attempts don't attach to it again.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        # board name -> SharedMemory, (board name, slot) -> number of attempts running with the slot
+        self.boards = {}
+        self.slots = collections.Counter()
+        self.last_board = None
+        threading.Thread(target=self._beat, daemon=True).start()
+
+    def _write(self, name, slot):
+        _BEAT.pack_into(self.boards[name].buf, slot * _BEAT.size, time.monotonic())
+
+    def _beat(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                for name, slot in self.slots:
+                    self._write(name, slot)
+
+    def start(self, name, slot):
+        """
+        Starts the heartbeats of an attempt, the first one is written right away.
+        :return: False if the board isn't reachable (the worker is on another machine)
+        """
+        with self.lock:
+            if name not in self.boards:
+                try:
+                    self.boards[name] = _attach_shared_memory(name)
+                except FileNotFoundError:
+                    return False
+            self.last_board = name
+            self.slots[name, slot] += 1
+            self._write(name, slot)
+        return True
+
+    def stop(self, name, slot):
+        with self.lock:
+            self.slots[name, slot] -= 1
+            if not self.slots[name, slot]:
+                del self.slots[name, slot]
+            # boards of earlier runs are closed once none of their attempts is running
+            busy = {board for board, _ in self.slots}
+            for board in [board for board in self.boards if board not in busy and board != self.last_board]:
+                self.boards.pop(board).close()
+
+
+_heart = None
+_heart_lock = threading.Lock()
+
+
+def _reset_heart():
+    # a forked worker inherits the heart of its parent but not its thread, and maybe a held lock
+    global _heart, _heart_lock
+    _heart = None
+    _heart_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_heart)
+
+
+def _run_attempt(board_name, slot, interval, function, args):
+    """
+    Runs an attempt of a task in a worker. While it runs, the time is written to its slot of the heartbeat
+    board every interval seconds, so the scheduler can tell a running attempt from one whose worker died.
+    """
+    global _heart
+    with _heart_lock:
+        if _heart is None:
+            _heart = _Heart(interval)
+    if not _heart.start(board_name, slot):
+        # a worker on another machine doesn't see the board, it is only covered by timeouts and retries
+        return function(*args)
+    try:
+        return function(*args)
+    finally:
+        _heart.stop(board_name, slot)
+
+
+class _Attempt(object):
+    __slots__ = ('index', 'slot', 'submitted', 'started', 'backup')
+
+    def __init__(self, index, slot, backup):
+        self.index = index
+        self.slot = slot
+        self.submitted = time.monotonic()
+        self.started = None
+        self.backup = backup
+
+
+class TaskScheduler(object):
+    """
+    Runs tasks on a worker pool and tracks every attempt of every task:
+    - a task which raises is re-executed, up to max_attempts attempts in all;
+    - an attempt whose heartbeats stop (its worker process crashed) or which runs longer than task_timeout
+      is abandoned and the task is re-executed;
+    - once all tasks are submitted, an attempt running speculation times longer than the median task gets
+      a backup copy, the result of whichever finishes first is taken.
+    Tasks therefore have to be idempotent: every attempt may run to the end, only one result is used.
+    """
+    def __init__(self, max_attempts=3, task_timeout=None, heartbeat_interval=0.5, heartbeat_timeout=10.0,
+                 speculation=2.0, min_speculation_time=1.0, poll_interval=0.05, heartbeat_slots=2 ** 12):
+        """
+        :param max_attempts: number of failed attempts after which the error of a task is raised
+        :param task_timeout: seconds an attempt may run, no limit if None
+        :param heartbeat_interval: seconds between heartbeats of a running attempt, None disables heartbeats
+        :param heartbeat_timeout: seconds without a heartbeat after which an attempt is considered lost
+        :param speculation: slowdown relative to the median task time after which a backup attempt is started,
+                            None disables speculative execution
+        :param min_speculation_time: attempts running shorter than this many seconds get no backup
+        :param poll_interval: seconds between checks of the running attempts
+        :param heartbeat_slots: number of attempts which can be tracked by heartbeats at a time
+        """
+        self.max_attempts = max_attempts
+        self.task_timeout = task_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.speculation = speculation
+        self.min_speculation_time = min_speculation_time
+        self.poll_interval = poll_interval
+        self.heartbeat_slots = heartbeat_slots
+        # pools with attempts which were still running when the tasks were done, they have to be terminated
+        self.stuck_pools = set()
+        # shared memory block with a heartbeat slot per attempt, it is kept for all the runs so that
+        # workers attach to it once, and the slots which are not used by an attempt
+        self.board = None
+        self.free_slots = []
+
+    def __getstate__(self):
+        # the scheduler is pickled to workers together with the job
+        state = self.__dict__.copy()
+        state['stuck_pools'] = set()
+        state['board'] = None
+        state['free_slots'] = []
+        return state
+
+    def _open_board(self):
+        if self.board is None:
+            self.board = shared_memory.SharedMemory(create=True, size=self.heartbeat_slots * _BEAT.size)
+            self.board.buf[:] = bytes(self.heartbeat_slots * _BEAT.size)
+            self.free_slots = list(range(self.heartbeat_slots))
+            atexit.register(self.close)
+        return self.board
+
+    def close(self):
+        """
+        Frees the heartbeat board.
+        """
+        if self.board is not None:
+            self.board.close()
+            self.board.unlink()
+            self.board = None
+
+    def run(self, pool, target, tasks, window, verbose=False):
+        """
+        Runs target(*args) for every args of tasks. Tasks are taken lazily, at most window of them
+        are in progress at a time, so a generator of tasks is never materialized.
+        If tracing is enabled, every attempt records its time in the queue and in the worker.
+        :param pool: pool with apply_async accepting callback and error_callback
+        :return: list of task results in the order of tasks
+        """
+        return _Run(self, pool, target, window, verbose).run(tasks)
+
+
+class _Run(object):
+    """
+    State of TaskScheduler.run.
+    """
+    def __init__(self, scheduler, pool, target, window, verbose):
+        self.scheduler = scheduler
+        self.pool = pool
+        self.target = target
+        self.name = target.__name__.strip('_')
+        self.window = window
+        self.verbose = verbose
+        # tasks run inline by a serial pool can't be lost or overtaken
+        self.tracked = not isinstance(pool, executors.SerialPool)
+        self.completed = queue.Queue()
+        self.attempt_ids = itertools.count()
+        # attempt id -> _Attempt of the attempts in progress and of the abandoned ones
+        self.attempts = {}
+        self.abandoned = {}
+        # index -> args of the tasks in progress
+        self.pending = {}
+        self.failures = {}
+        self.results = {}
+        self.durations = []
+        self.exhausted = False
+        self.board = None
+        # slots of attempts which are still running when the run ends are never reused
+        self.free_slots = scheduler.free_slots
+        if self.tracked and scheduler.heartbeat_interval is not None:
+            self.board = scheduler._open_board()
+            self.free_slots = scheduler.free_slots
+
+    def run(self, tasks):
+        tasks = iter(tasks)
+        try:
+            for index in itertools.count():
+                while len(self.pending) >= self.window:
+                    self._wait()
+                try:
+                    args = next(tasks)
+                except StopIteration:
+                    break
+                self.pending[index] = args
+                self.failures[index] = 0
+                self._submit(index)
+            self.exhausted = True
+            while self.pending:
+                self._wait()
+            return [self.results[index] for index in range(len(self.results))]
+        finally:
+            # abandoned attempts and the losers of speculative execution may never finish
+            if self.abandoned or self.attempts:
+                self.scheduler.stuck_pools.add(self.pool)
+
+    def _submit(self, index, backup=False):
+        attempt_id = next(self.attempt_ids)
+        slot = self.free_slots.pop() if self.free_slots else None
+        if slot is not None:
+            _BEAT.pack_into(self.board.buf, slot * _BEAT.size, 0.0)
+            function, args = _run_attempt, (self.board.name, slot, self.scheduler.heartbeat_interval,
+                                            self.target, self.pending[index])
+        else:
+            function, args = self.target, self.pending[index]
+        self.attempts[attempt_id] = _Attempt(index, slot, backup)
+        self.pool.apply_async(*tracing.traced(self.name, function, args),
+                              callback=lambda value: self.completed.put((attempt_id, True, value)),
+                              error_callback=lambda error: self.completed.put((attempt_id, False, error)))
+
+    def _live_attempts(self, index):
+        return [attempt for attempt in self.attempts.values() if attempt.index == index]
+
+    def _wait(self):
+        """
+        Waits for the next attempt to finish or for the next check of the running attempts.
+        """
+        try:
+            attempt_id, ok, value = self.completed.get(timeout=self.scheduler.poll_interval if self.tracked else None)
+        except queue.Empty:
+            self._check()
+            return
+        abandoned = attempt_id in self.abandoned
+        attempt = self.abandoned.pop(attempt_id) if abandoned else self.attempts.pop(attempt_id)
+        if attempt.slot is not None:
+            self.free_slots.append(attempt.slot)
+        if attempt.index not in self.pending:
+            # the task is already done by another attempt
+            return
+        if ok:
+            # an abandoned attempt which finishes after all is as good as its re-execution
+            self._done(attempt, tracing.result(value))
+        elif not abandoned:
+            self._failed(attempt, value)
+
+    def _done(self, attempt, value):
+        index = attempt.index
+        del self.pending[index]
+        self.results[index] = value
+        self.durations.append(time.monotonic() - (attempt.started or attempt.submitted))
+        if attempt.backup:
+            print("Backup attempt of {0} task {1} finished first".format(self.name, index))
+        if self.verbose:
+            print("Output of task {0}:".format(index))
+            print(value)
+
+    def _failed(self, attempt, error):
+        """
+        Re-executes the task of a failed attempt, unless it has another attempt in progress.
+        Raises the error once the task has failed max_attempts times.
+        """
+        index = attempt.index
+        self.failures[index] += 1
+        if self.failures[index] >= self.scheduler.max_attempts:
+            raise error
+        print("Attempt of {0} task {1} failed with {2!r}, it is re-executed".format(self.name, index, error))
+        if not self._live_attempts(index):
+            self._submit(index)
+
+    def _check(self):
+        """
+        Abandons lost and timed out attempts and starts backups of stragglers.
+        """
+        now = time.monotonic()
+        median = statistics.median(self.durations) if self.durations else None
+        for attempt_id, attempt in list(self.attempts.items()):
+            if attempt.index not in self.pending:
+                continue
+            beat = _BEAT.unpack_from(self.board.buf, attempt.slot * _BEAT.size)[0] if attempt.slot is not None else 0
+            if beat and attempt.started is None:
+                attempt.started = beat
+            if attempt.slot is None:
+                # without heartbeats the time in the queue of the pool counts too
+                attempt.started = attempt.submitted
+            error = None
+            if beat and now - beat > self.scheduler.heartbeat_timeout:
+                error = TimeoutError("no heartbeat for {0:.1f} s, the worker is lost".format(now - beat))
+            running = now - (attempt.started or attempt.submitted)
+            if self.scheduler.task_timeout is not None and attempt.started and running > self.scheduler.task_timeout:
+                error = TimeoutError("the attempt runs for more than {0} s".format(self.scheduler.task_timeout))
+            if error is not None:
+                # its slot isn't reused until it finishes, if its worker is gone it never does
+                self.abandoned[attempt_id] = self.attempts.pop(attempt_id)
+                self._failed(attempt, error)
+            elif (self.exhausted and self.scheduler.speculation is not None and median is not None
+                  and attempt.started is not None and len(self._live_attempts(attempt.index)) == 1
+                  and running > max(self.scheduler.speculation * median, self.scheduler.min_speculation_time)):
+                print("{0} task {1} runs for {2:.3f} s, {3:.1f} times the median, a backup attempt is started".format(
+                    self.name, attempt.index, running, running / median if median else float('inf')))
+                self._submit(attempt.index, backup=True)
@@ -0,0 +1,51 @@
+import heapq
+import itertools
+import operator
+import os
+import pickle
+import tempfile
+
+
+def write_run(items, directory):
+    """
+    Writes (key, values) pairs sorted by key to a new run file.
+    :param items: dict(key, values) or iterable of (key, values) pairs
+    :param directory: directory for the run file
+    :return: path to the run file
+    """
+    if isinstance(items, dict):
+        items = items.items()
+    fd, path = tempfile.mkstemp(suffix='.run', dir=directory)
+    with os.fdopen(fd, 'wb', buffering=2 ** 20) as f:
+        for item in sorted(items, key=operator.itemgetter(0)):
+            pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def read_run(path):
+    """
+    Lazily reads (key, values) pairs from a run file.
+    """
+    with open(path, 'rb', buffering=2 ** 20) as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def merge_runs(runs):
+    """
+    Merges sorted runs into a single stream of (key, values) grouped by key. Only one
+    record of every run is held in memory at a time.
+    :param runs: list of runs, each run is either a path to a run file or an in-memory dict
+    :return: generator of (key, values) with keys in ascending order
+    """
+    iterators = [read_run(run) if isinstance(run, str) else iter(sorted(run.items(), key=operator.itemgetter(0)))
+                 for run in runs]
+    merged = heapq.merge(*iterators, key=operator.itemgetter(0))
+    for key, group in itertools.groupby(merged, key=operator.itemgetter(0)):
+        values = []
+        for _, value in group:
+            values += value
+        yield key, values
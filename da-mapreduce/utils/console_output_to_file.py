@@ -1,35 +1,112 @@
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
 import sys
-import time
+import threading
+
+
+class _LineWriter(object):
+    """
+    Replacement of sys.stdout which sends every complete line as a log record. Fragments written by
+    print are kept until the end of the line, separately for every thread, so lines of concurrent workers
+    never interleave.
+    """
+    def __init__(self, logger, level):
+        self.logger = logger
+        self.level = level
+        self._local = threading.local()
+
+    def write(self, data):
+        if not self.logger.isEnabledFor(self.level):
+            return len(data)
+        buffer = getattr(self._local, 'buffer', '') + data
+        if '\n' in buffer:
+            *lines, buffer = buffer.split('\n')
+            for line in lines:
+                self.logger.log(self.level, line)
+        self._local.buffer = buffer
+        return len(data)
+
+    def finish_line(self):
+        """
+        Sends the unfinished line of the calling thread, if there is one.
+        """
+        if getattr(self._local, 'buffer', ''):
+            self.write('\n')
+
+    def flush(self):
+        pass
+
+
+class _BlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records to the bounded queue waiting for a free place instead of failing when it is full.
+    """
+    def enqueue(self, record):
+        self.queue.put(record)
 
 
 class copyConsoleToFile(object):
     """ Enables logging of console output to a file, use
     >> tlogger = copyConsoleToFile('logfile.txt', 'w')
     at the start of the code to start logging.
+
+    Printed lines, also the ones of worker processes forked afterwards, go as log records to a bounded
+    multiprocessing queue. A background thread writes them to the console and, in batches, to the file,
+    so printing never waits for the disk. Lines below level are dropped, tlogger.logger can be used
+    to log at other levels than the one of printed lines.
     """
-    def __init__(self, name, mode, add_timestamp = False):
-        self.file = open(name, mode)
+    def __init__(self, name, mode, add_timestamp = False, level=logging.INFO, print_level=logging.INFO,
+                 buffer_size=2 ** 14, batch_size=1024):
+        """
+        :param name: path to the log file
+        :param mode: mode the file is opened in, 'w' or 'a'
+        :param add_timestamp: prefix every line in the file with the time it was printed
+        :param level: records below it are dropped
+        :param print_level: level of the printed lines
+        :param buffer_size: number of records the queue holds, printing blocks when it is full
+        :param batch_size: number of records written to the file at once
+        """
+        self.queue = multiprocessing.Queue(buffer_size)
+        file_handler = logging.FileHandler(name, mode)
+        file_handler.setFormatter(logging.Formatter('%(asctime)s: %(message)s' if add_timestamp else '%(message)s',
+                                                    "%Y-%m-%d %H:%M:%S"))
+        self.file = file_handler
+        self.file_handler = logging.handlers.MemoryHandler(batch_size, logging.ERROR, file_handler)
         self.stdout = sys.stdout
-        self.add_timestamp = add_timestamp
-        sys.stdout = self
+        self.console_handler = logging.StreamHandler(self.stdout)
+        self.listener = logging.handlers.QueueListener(self.queue, self.console_handler, self.file_handler)
+        self.listener.start()
+        self.logger = logging.getLogger('console')
+        self.logger.setLevel(level)
+        self.logger.propagate = False
+        self.queue_handler = _BlockingQueueHandler(self.queue)
+        self.logger.addHandler(self.queue_handler)
+        self.writer = _LineWriter(self.logger, print_level)
+        sys.stdout = self.writer
+        atexit.register(self.close)
 
     def close(self):
+        """
+        Restores sys.stdout and writes out all the queued records.
+        """
         if self.stdout is not None:
-            sys.stdout = self.stdout
+            self.writer.finish_line()
+            if sys.stdout is self.writer:
+                sys.stdout = self.stdout
             self.stdout = None
-        if self.file is not None:
+            self.logger.removeHandler(self.queue_handler)
+            self.listener.stop()
+            self.file_handler.close()
             self.file.close()
-            self.file = None
+            self.queue.close()
 
     def write(self, data):
-        if self.add_timestamp:
-            self.file.write(time.strftime("%Y-%m-%d %H:%M:%S") + ': ')
-        self.file.write(data)
-        self.stdout.write(data)
+        sys.stdout.write(data)
 
     def flush(self):
-        self.file.flush()
-        self.stdout.flush()
+        pass
 
     def __del__(self):
-        self.close()
\ No newline at end of file
+        self.close()
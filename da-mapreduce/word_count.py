@@ -0,0 +1,65 @@
+import heapq
+import sys
+import time
+
+from pipeline import Pipeline
+
+top_k = 10
+
+
+def split_words(line):
+    return line.lower().split()
+
+
+def is_word(word):
+    return word.isalpha()
+
+
+def word_count_mapper(input_el, output):
+    output[input_el] += [1]
+
+
+def word_count_reducer(input_key, input_value, output):
+    output[input_key] += sum(input_value)
+
+
+def top_k_mapper(input_el, output):
+    word, count = input_el
+    output['top'] += [(count, word)]
+
+
+def top_k_reducer(input_key, input_value, output):
+    output[input_key] = heapq.nlargest(top_k, input_value)
+
+
+def explode_top_k(input_el):
+    return input_el[1]
+
+
+def word_length_mapper(input_el, output):
+    count, word = input_el
+    output[len(word)] += [1]
+
+
+if __name__ == '__main__':
+    num_workers = 4
+    input_path = sys.argv[1] if len(sys.argv) > 1 else __file__
+
+    # word count -> top k -> histogram of lengths of the top words
+    pipeline = (Pipeline(num_workers)
+                .map(split_words)
+                .filter(is_word)
+                .map_reduce(word_count_mapper, word_count_reducer, the_combiner=word_count_reducer)
+                .map_reduce(top_k_mapper, top_k_reducer)
+                .map(explode_top_k)
+                .map_reduce(word_length_mapper, word_count_reducer, the_combiner=word_count_reducer))
+
+    with pipeline:
+        start = time.time()
+        length_counts = pipeline(input_path, num_workers)
+        end = time.time()
+
+    print('\nNumber of words among the top {0} per word length\n'.format(top_k))
+    for length, count in length_counts:
+        print('{length:}: {count:5}'.format(length=length, count=count))
+    print('\nTime spent: {} s'.format(end - start))
@@ -0,0 +1,148 @@
+import math
+import multiprocessing
+import multiprocessing.pool
+import time
+
+
+class _Done(object):
+    """
+    Result of a task which is already run, with the interface of multiprocessing.pool.AsyncResult.
+    """
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return self.error is None
+
+    def wait(self, timeout=None):
+        pass
+
+    def get(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SerialPool(object):
+    """
+    Runs every task inline in the calling process as soon as it is submitted. It has the part
+    of the interface of multiprocessing.Pool used by the algorithms, so it can replace it when
+    the input is too small to pay for starting workers and sending data to them.
+    """
+    def __init__(self, processes=None):
+        self._processes = 1
+
+    def apply_async(self, func, args=(), kwds=None, callback=None, error_callback=None):
+        try:
+            result = _Done(func(*args, **(kwds or {})))
+        except Exception as error:
+            if error_callback is not None:
+                error_callback(error)
+            return _Done(error=error)
+        if callback is not None:
+            callback(result.value)
+        return result
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+# backend name -> pool class, all of them take the number of workers and have apply_async, close and join
+BACKENDS = {
+    'serial': SerialPool,
+    # threads run tasks in parallel when they release the GIL, as NumPy kernels do, or on free-threaded CPython
+    'thread': multiprocessing.pool.ThreadPool,
+    'process': multiprocessing.Pool,
+}
+
+
+def make_pool(backend, num_workers):
+    """
+    Starts a pool of the backend.
+    :param backend: 'serial', 'thread' or 'process'
+    :param num_workers: number of workers
+    """
+    if backend not in BACKENDS:
+        raise ValueError("unknown backend {0}, use one of {1}".format(backend, sorted(BACKENDS)))
+    return BACKENDS[backend](processes=num_workers)
+
+
+def shutdown(pool, stuck=False):
+    """
+    Closes the pool and waits for its workers to finish.
+    :param stuck: True if some tasks of the pool never finish (their worker is lost or hung), then waiting
+                  would never end: worker processes are terminated, threads can't be, they are left behind
+    """
+    if not stuck:
+        pool.close()
+        pool.join()
+    elif isinstance(pool, multiprocessing.pool.ThreadPool):
+        pool.close()
+    else:
+        pool.terminate()
+        pool.join()
+
+
+def _noop():
+    pass
+
+
+_overheads = {}
+
+
+def measure_overhead(backend):
+    """
+    Measures once per process how long it takes to start a pool of the backend with a single worker,
+    run an empty task on it and shut it down.
+    :return: overhead in seconds
+    """
+    if backend not in _overheads:
+        start = time.perf_counter()
+        pool = make_pool(backend, 1)
+        pool.apply_async(_noop).get()
+        pool.close()
+        pool.join()
+        _overheads[backend] = time.perf_counter() - start
+    return _overheads[backend]
+
+
+def measure_work(function, *args):
+    """
+    :return: time in seconds function(*args) takes
+    """
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def choose_backend(work, num_workers=None, gil_free=False):
+    """
+    Automatic policy: runs the job serially unless its work is several times the overhead of starting
+    workers, with threads if the tasks release the GIL and processes otherwise. Every worker has to get
+    at least the overhead worth of work.
+    :param work: estimated time in seconds the job takes serially, None or infinity if it isn't known,
+                 like for streamed inputs, then all the workers are used
+    :param num_workers: maximum number of workers, defaults to number of CPUs
+    :param gil_free: True if tasks spend their time in code which releases the GIL
+    :return: (backend, number of workers)
+    """
+    num_workers = num_workers or multiprocessing.cpu_count()
+    backend = 'thread' if gil_free else 'process'
+    if num_workers == 1:
+        return 'serial', 1
+    if work is None or math.isinf(work):
+        return backend, num_workers
+    overhead = measure_overhead(backend)
+    if work < 4 * overhead:
+        return 'serial', 1
+    return backend, max(2, min(num_workers, int(work / overhead)))
@@ -0,0 +1,364 @@
+import atexit
+import multiprocessing
+
+import numpy as np
+
+import dataset
+import executors
+import tracing
+from shared_array import SharedArray
+
+
+# built-in associative operators of scans
+OPERATORS = {
+    'sum': np.add,
+    'product': np.multiply,
+    'max': np.maximum,
+    'min': np.minimum,
+}
+
+
+def as_ufunc(op):
+    """
+    Turns an operator of a scan into a ufunc: a name from OPERATORS, a ufunc or a Python function
+    of two arguments, which has to be associative (and picklable to be sent to the workers).
+    """
+    if isinstance(op, str):
+        return OPERATORS[op]
+    if isinstance(op, np.ufunc):
+        return op
+    return np.frompyfunc(op, 2, 1)
+
+
+def _identity(op, dtype, identity=None):
+    """
+    Finds the identity element of the operator, which is the first value of an exclusive scan.
+    """
+    if identity is not None:
+        return identity
+    ufunc = as_ufunc(op)
+    if ufunc.identity is not None:
+        return ufunc.identity
+    if ufunc in (np.maximum, np.minimum):
+        info = np.iinfo(dtype) if np.dtype(dtype).kind in 'iu' else np.finfo(dtype)
+        return info.min if ufunc is np.maximum else info.max
+    raise ValueError("exclusive scan with {0} needs an identity".format(getattr(op, '__name__', op)))
+
+
+def _accumulate(op, values):
+    """
+    Inclusive scan of values in place.
+    """
+    if op.types == ['OO->O']:
+        values[...] = op.accumulate(values.astype(object))
+    else:
+        op.accumulate(values, out=values)
+
+
+def combine(op, left, values):
+    """
+    Applies op(left, value) to values in place, this is how a carry is added to a scanned block.
+    :param op: ufunc, see as_ufunc
+    """
+    if op.types == ['OO->O']:
+        values[...] = op(left, values)
+    else:
+        op(left, values, out=values)
+
+
+def _segmented_accumulate(op, values, flags):
+    """
+    Inclusive segmented scan of values in place, a segment starts at every set flag. A block with a few
+    long segments is scanned segment by segment, otherwise all segments are scanned at once by doubling:
+    on step d every value which hasn't reached the start of its segment yet takes in the value d positions
+    before it, until d is longer than any segment.
+    """
+    bounds = np.concatenate(([0], np.flatnonzero(flags), [len(values)]))
+    if len(bounds) <= len(values) // 64 + 2:
+        for lbound, rbound in zip(bounds[:-1], bounds[1:]):
+            if rbound > lbound:
+                _accumulate(op, values[lbound:rbound])
+        return
+    reached = np.array(flags, dtype=bool)
+    longest = np.diff(bounds).max()
+    step = 1
+    while step < longest:
+        combined = op(values[:-step], values[step:])
+        update = ~reached[step:]
+        values[step:][update] = combined[update]
+        reached[step:] |= reached[:-step]
+        step *= 2
+
+
+def _scan_block(shared, lbound, rbound, op, flags=None):
+    """
+    Scans indices [lbound, rbound) of the shared array in place, flags are indexed from 1 like the values.
+    :return: (whether a segment starts in the block, scan of its last segment)
+    """
+    try:
+        op = as_ufunc(op)
+        block = shared.array[lbound:rbound]
+        if flags is None:
+            _accumulate(op, block)
+            total = False, block[-1]
+        else:
+            block_flags = flags.array[lbound - 1:rbound - 1]
+            _segmented_accumulate(op, block, block_flags)
+            total = bool(block_flags.any()), block[-1]
+            del block_flags
+        del block
+        return total
+    finally:
+        shared.close()
+        if flags is not None:
+            flags.close()
+
+
+def _add_carry(shared, lbound, rbound, op, carry, flags=None, identity=None):
+    """
+    Applies the scan of all the blocks before it to the values of a scanned block up to the start
+    of its first segment. For an exclusive segmented scan it also puts the identity at the places
+    of the starts of segments, that is right after the last value of every segment.
+    """
+    try:
+        op = as_ufunc(op)
+        block = shared.array[lbound:rbound]
+        end = len(block)
+        if flags is not None:
+            block_flags = flags.array[lbound - 1:rbound - 1]
+            if block_flags.any():
+                end = int(np.argmax(block_flags))
+        if carry is not None and end:
+            combine(op, carry, block[:end])
+        if flags is not None and identity is not None:
+            block[:len(flags) - lbound][flags.array[lbound:rbound]] = identity
+            del block_flags
+        del block
+    finally:
+        shared.close()
+        if flags is not None:
+            flags.close()
+
+
+class ParallelScanner(object):
+    """
+    Computes scans (prefix sums with any associative operator) of arrays in shared memory with
+    a persistent pool of workers, which is started lazily and reused by all the scans until close()
+    is called. Workers are processes, threads or the calling process itself, depending on the backend
+    (see executors.BACKENDS).
+    """
+    def __init__(self, num_workers=None, backend='process'):
+        """
+        :param num_workers: size of the worker pool, defaults to number of CPUs or to the size of the backend pool
+        :param backend: 'serial', 'thread', 'process' or 'auto' to pick the backend and the number of workers
+                        for every scan from the size of its input (see executors.choose_backend).
+                        It can also be a pool object with apply_async, which is used as it is and not closed
+                        by close()
+        """
+        self.num_workers = num_workers or getattr(backend, 'num_workers', None) or multiprocessing.cpu_count()
+        self.backend = backend
+        # (backend, number of workers) -> pool, 'auto' may use several of them
+        self._pools = {}
+        self._pool = None
+        # size of the current pool, the work is split into this many blocks
+        self._workers = self.num_workers
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self, backend=None, num_workers=None):
+        """
+        Starts the pool of the backend, the configured one by default. With the 'auto' backend
+        pools are started when a scan picks them.
+        """
+        backend = backend or self.backend
+        if backend == 'auto':
+            return self
+        if not isinstance(backend, str):
+            self._pool = backend
+            self._workers = self.num_workers
+            return self
+        key = backend, num_workers or self.num_workers
+        if key not in self._pools:
+            with tracing.span('spawn', 'pool', backend=key[0], workers=key[1]):
+                self._pools[key] = executors.make_pool(*key)
+        self._pool = self._pools[key]
+        self._workers = key[1]
+        return self
+
+    @property
+    def workers(self):
+        """
+        Size of the current pool, the work of a scan is split into this many blocks.
+        """
+        return self._workers
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.close()
+            pool.join()
+        self._pools = {}
+        self._pool = None
+
+    def choose_backend(self, values, op='sum'):
+        """
+        With the 'auto' backend picks the pool of the next scan: small inputs are scanned serially, large ones
+        by as many workers as pay off their overhead - threads for NumPy operators, which release the GIL,
+        processes for Python ones. Code running its own tasks with run() calls it first, with the data they work on.
+        """
+        if self.backend != 'auto':
+            return
+        length = len(values)
+        # accumulate works in place, the sample is a copy
+        sample = np.array(values[:2 ** 12])
+        work = executors.measure_work(_accumulate, as_ufunc(op), sample) * length / max(len(sample), 1)
+        gil_free = isinstance(op, (str, np.ufunc))
+        self.start(*executors.choose_backend(work, self.num_workers, gil_free))
+
+    def run(self, tasks):
+        """
+        Runs (function, args) tasks in the pool and waits for all of them, which is the barrier
+        between the phases of a scan. If tracing is enabled, every task records its time in the queue
+        and in the worker. The functions have to be picklable for the process backend.
+        :return: list of the results of the tasks
+        """
+        if self._pool is None:
+            self.start('process' if self.backend == 'auto' else None)
+        results = [self._pool.apply_async(*tracing.traced(function.__name__.strip('_'), function, args))
+                   for function, args in tasks]
+        return [tracing.result(result.get()) for result in results]
+
+    def _scan(self, values, op, flags=None, identity=None, print_log=False):
+        """
+        Blocked three-phase scan: every worker scans its contiguous block of the shared array,
+        the totals of the blocks are scanned in the calling process and every worker applies the total
+        of the blocks before it to its block. There are two barriers whatever the length is.
+        Values are scanned into positions 1..n of the shared array, position 0 holds the identity,
+        so positions 0..n-1 are the exclusive scan.
+        :param identity: identity of the operator, only needed for an exclusive scan
+        :return: SharedArray of n + 1 elements, the caller has to unlink it
+        """
+        self.choose_backend(values, op)
+        length = len(values)
+        shared = SharedArray(length + 1, values.dtype)
+        shared_flags = None
+        try:
+            shared.array[0] = identity if identity is not None else 0
+            shared.array[1:] = values
+            if flags is not None:
+                shared_flags = SharedArray.copy_of(flags, dtype=bool)
+                if print_log:
+                    print("Starts of segments:", np.flatnonzero(shared_flags.array))
+            workers = min(self._workers, length)
+            bounds = [1 + length * i // workers for i in range(workers + 1)] if length else [1]
+            with tracing.span('scan blocks', 'scan', blocks=workers):
+                totals = self.run([(_scan_block, (shared, bounds[i], bounds[i + 1], op, shared_flags))
+                                    for i in range(workers)])
+            with tracing.span('scan totals', 'scan'):
+                carries = []
+                carry = None
+                for starts_segment, total in totals:
+                    carries.append(carry)
+                    carry = total if starts_segment or carry is None else as_ufunc(op)(carry, total)
+            if print_log:
+                print("Blocks:", bounds)
+                print("Totals of blocks:", [total for _, total in totals])
+                print(shared.array)
+            exclusive_identity = identity if shared_flags is not None else None
+            with tracing.span('add carries', 'scan'):
+                self.run([(_add_carry, (shared, bounds[i], bounds[i + 1], op, carries[i], shared_flags,
+                                         exclusive_identity))
+                           for i in range(workers) if carries[i] is not None or exclusive_identity is not None])
+            if print_log:
+                print(shared.array)
+            return shared
+        except BaseException:
+            shared.unlink()
+            raise
+        finally:
+            if shared_flags is not None:
+                shared_flags.unlink()
+
+    def scan(self, data, op='sum', exclusive=False, flags=None, identity=None, dtype=None, print_log=False):
+        """
+        Parallel scan with an associative operator.
+        :param data: list or ndarray of values of any NumPy dtype except object
+        :param op: 'sum', 'product', 'max', 'min', a ufunc of two arguments or an associative Python
+                   function of two arguments, which is much slower as it is applied to every pair of values
+        :param exclusive: if True, element i of the result combines elements before i, otherwise up to i
+        :param flags: optional booleans of the length of data, a scan starts over at every set flag
+        :param identity: identity of the operator for an exclusive scan, found for ufuncs which have one
+                         and for max and min
+        :param dtype: dtype of the scan, defaults to the dtype of data
+        :param print_log: prints intermediate states of the array
+        :return: list if data is a list, otherwise ndarray over the result buffer
+        """
+        values = np.asarray(data, dtype=dtype)
+        if values.dtype.hasobject:
+            raise TypeError("Python objects can't be scanned in shared memory, use a NumPy dtype")
+        if flags is not None and len(flags) != len(values):
+            raise ValueError("flags must have the length of data: {0} != {1}".format(len(flags), len(values)))
+        identity = _identity(op, values.dtype, identity) if exclusive else None
+        shared = self._scan(values, op, flags, identity, print_log)
+        try:
+            if isinstance(data, list):
+                return shared.array[:-1].tolist() if exclusive else shared.array[1:].tolist()
+            result = shared.detach()
+            return result[:-1] if exclusive else result[1:]
+        finally:
+            shared.unlink()
+
+    def prefix_sum(self, sequence, print_log=False):
+        """
+        Parallel prefix sum, see _scan.
+        :param sequence: list or ndarray of numbers
+        :return: prefix sums with a leading 0, like sequential_prefix_sum: list if sequence is a list,
+                 otherwise ndarray over the result buffer
+        """
+        shared = self._scan(np.asarray(sequence), 'sum', identity=0, print_log=print_log)
+        try:
+            return shared.array.tolist() if isinstance(sequence, list) else shared.detach()
+        finally:
+            shared.unlink()
+
+
+_default_scanners = {}
+
+
+def get_default_scanner(num_workers=None, backend='auto'):
+    """
+    Returns the scanner of the module with the given number of workers and backend, its pools are reused
+    by all the calls.
+    """
+    if (num_workers, backend) not in _default_scanners:
+        _default_scanners[num_workers, backend] = ParallelScanner(num_workers, backend)
+        atexit.register(_default_scanners[num_workers, backend].close)
+    return _default_scanners[num_workers, backend]
+
+
+def scan(data, op='sum', exclusive=False, flags=None, identity=None, dtype=None, workers=None, backend='auto',
+         output=None):
+    """
+    Parallel scan on a pool shared by the calls, see ParallelScanner.scan
+    :param data: list, ndarray or dataset.Dataset
+    :param workers: maximum number of workers, defaults to number of CPUs
+    :param backend: 'serial', 'thread', 'process' or 'auto' to pick it from the size of data
+    :param output: optional path to a dataset file the result is written to
+    """
+    result = get_default_scanner(workers, backend).scan(data, op, exclusive, flags, identity, dtype)
+    if output is not None:
+        with tracing.span('write output', 'scan'):
+            dataset.write(output, result)
+    return result
+
+
+def pooled_prefix_sum(sequence, print_log=False):
+    """
+    Parallel prefix sum on the shared pool of the module, see ParallelScanner.prefix_sum
+    :param sequence: list or ndarray of numbers
+    :return: list containing prefix sum if sequence is a list, otherwise ndarray
+    """
+    return get_default_scanner().prefix_sum(sequence, print_log)
@@ -1,7 +1,10 @@
 import math
 import multiprocessing
 import time
-import matplotlib.pyplot as plt
+import numpy as np
+
+import tracing
+from parallel_scan import pooled_prefix_sum, scan
 
 def sequential_prefix_sum(sequence):
     """
@@ -61,10 +64,10 @@ def parallel_prefix_sum(sequence, max_cores=4, print_log = False):
         print("Depth:", depth)
 
     array = multiprocessing.Array('i', input_seq)
-    jobs = []
 
     # first_phase - upward summator
     for level in range(0, int(depth)):
+        jobs = []
         if print_log:
             print("Level:", level)
         processing_field = 2 ** (level + 1)
@@ -72,13 +75,14 @@ def parallel_prefix_sum(sequence, max_cores=4, print_log = False):
         if core_number > max_cores:
             core_number = max_cores
             processing_field = int(length / core_number)
-        for i in range(core_number):
-            p = multiprocessing.Process(target = _upward_summator, args=(array, level, i, processing_field, print_log))
-            p.daemon = False
-            jobs.append(p)
-            p.start()
-        for p in jobs:
-            p.join()
+        with tracing.span('up-sweep level', 'scan', level=level, workers=core_number):
+            for i in range(core_number):
+                p = multiprocessing.Process(target = _upward_summator, args=(array, level, i, processing_field, print_log))
+                p.daemon = False
+                jobs.append(p)
+                p.start()
+            for p in jobs:
+                p.join()
         if print_log:
             print(array[:])
 
@@ -87,6 +91,7 @@ def parallel_prefix_sum(sequence, max_cores=4, print_log = False):
 
     # second phase - downward summator
     for level in range(int(depth), -1, -1):
+        jobs = []
         if print_log:
             print("Level:", level)
         processing_field = 2 ** (level + 1)
@@ -94,13 +99,14 @@ def parallel_prefix_sum(sequence, max_cores=4, print_log = False):
         if core_number > max_cores:
             core_number = max_cores
             processing_field = int(length / core_number)
-        for i in range(core_number):
-            p = multiprocessing.Process(target = _downward_summator, args=(array, level, i, processing_field, print_log))
-            p.daemon = False
-            jobs.append(p)
-            p.start()
-        for p in jobs:
-            p.join()
+        with tracing.span('down-sweep level', 'scan', level=level, workers=core_number):
+            for i in range(core_number):
+                p = multiprocessing.Process(target = _downward_summator, args=(array, level, i, processing_field, print_log))
+                p.daemon = False
+                jobs.append(p)
+                p.start()
+            for p in jobs:
+                p.join()
         array[length] = cumsum
         if (print_log):
             print(array[:])
@@ -108,6 +114,9 @@ def parallel_prefix_sum(sequence, max_cores=4, print_log = False):
 
 
 if __name__ == '__main__':
+    # only the plots need matplotlib, the functions are imported by the benchmarks
+    import matplotlib.pyplot as plt
+
     max_cores = 4
     #sequence_size = 200
     print_log = False
@@ -116,10 +125,16 @@ if __name__ == '__main__':
     if run_single:
         sequence = [1]*16
         parallel_prefix_sum(sequence, max_cores, True)
+        print(pooled_prefix_sum(sequence, True))
+        # running maximum and cumulative sums restarting at every flag
+        print(scan([3, 1, 4, 1, 5, 9, 2, 6], 'max'))
+        print(scan(sequence, 'sum', flags=[i % 5 == 0 for i in range(len(sequence))]))
     else:
         sizes = range(1, 15)
         time_sequential = []
         time_parallel = []
+        time_pooled = []
+        time_numpy = []
 
         for size in sizes:
             sequence_size = 2**size
@@ -138,10 +153,25 @@ if __name__ == '__main__':
 
             print('Parallel prefix sum with input sequence length {0} took {1}s'.format(sequence_size, time_taken))
 
+            array = np.array(sequence)
+            time_start = time.time()
+            pooled_prefix_sum(array)
+            time_taken = time.time() - time_start
+            time_pooled.append(time_taken)
+            print('Pooled prefix sum with input sequence length {0} took {1}s'.format(sequence_size, time_taken))
+
+            time_start = time.time()
+            np.cumsum(array)
+            time_taken = time.time() - time_start
+            time_numpy.append(time_taken)
+            print('numpy.cumsum with input sequence length {0} took {1}s'.format(sequence_size, time_taken))
+
         plt.figure()
         plt.plot(sizes, time_sequential)
         plt.plot(sizes, time_parallel)
-        plt.legend(["Sequential", "Parallel"], loc=2)
+        plt.plot(sizes, time_pooled)
+        plt.plot(sizes, time_numpy)
+        plt.legend(["Sequential", "Parallel", "Pooled", "numpy.cumsum"], loc=2)
         plt.xlabel("Size of input sequence")
         plt.ylabel("Run time")
         plt.show()
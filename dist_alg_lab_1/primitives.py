@@ -0,0 +1,182 @@
+import numpy as np
+
+from parallel_scan import get_default_scanner
+from shared_array import SharedArray
+
+
+def _evaluate_block(array, mask, lbound, rbound, predicate):
+    """
+    Evaluates the predicate on a block of the shared array into the shared mask.
+    :return: number of elements of the block which are kept
+    """
+    try:
+        block_mask = mask.array[lbound:rbound]
+        block_mask[...] = predicate(array.array[lbound:rbound])
+        count = int(np.count_nonzero(block_mask))
+        del block_mask
+        return count
+    finally:
+        array.close()
+        mask.close()
+
+
+def _compact_block(array, mask, out, lbound, rbound, offset):
+    """
+    Writes the kept elements of a block to the output from offset, the number of elements kept
+    by all the blocks before it.
+    """
+    try:
+        kept = array.array[lbound:rbound][mask.array[lbound:rbound]]
+        out.array[offset:offset + len(kept)] = kept
+    finally:
+        array.close()
+        mask.close()
+        out.close()
+
+
+def _bucket_ids(block, key):
+    """
+    Buckets of the elements of a block: the elements themselves or key(block).
+    """
+    return block if key is None else np.asarray(key(block))
+
+
+def _count_block(keys, counts, row, lbound, rbound, key):
+    """
+    Counts elements of a block of the shared array per bucket into its row of the shared counts.
+    """
+    try:
+        block_counts = np.bincount(_bucket_ids(keys.array[lbound:rbound], key), minlength=counts.shape[1])
+        if len(block_counts) > counts.shape[1]:
+            raise ValueError("bucket {0} is out of range of {1} buckets".format(len(block_counts) - 1,
+                                                                               counts.shape[1]))
+        counts.array[row] = block_counts
+    finally:
+        keys.close()
+        counts.close()
+
+
+def _partition_block(keys, out, lbound, rbound, offsets, key):
+    """
+    Moves elements of a block of the shared array to the output: an element of bucket b goes to offsets[b]
+    plus the number of elements of bucket b before it in the block, so the partition is stable.
+    """
+    try:
+        block = keys.array[lbound:rbound]
+        ids = _bucket_ids(block, key)
+        order = np.argsort(ids, kind='stable')
+        counts = np.bincount(ids, minlength=len(offsets))
+        sorted_ids = ids[order]
+        positions = offsets[sorted_ids] + np.arange(len(block)) - (np.cumsum(counts) - counts)[sorted_ids]
+        out.array[positions] = block[order]
+        del block
+    finally:
+        keys.close()
+        out.close()
+
+
+def _blocks(scanner, length):
+    """
+    Splits indices of an array into a contiguous block per worker of the scanner.
+    """
+    workers = min(scanner.workers, max(length, 1))
+    return [length * i // workers for i in range(workers + 1)]
+
+
+def parallel_filter(array, predicate, workers=None):
+    """
+    Stream compaction: every worker evaluates the predicate on its block and counts the kept elements,
+    the counts are scanned into the offsets of the blocks in the output and every worker writes
+    its kept elements to the preallocated shared output from its offset.
+    :param array: list or ndarray
+    :param predicate: function of a block (ndarray) returning a boolean mask of it, must be picklable
+    :param workers: maximum number of workers, defaults to number of CPUs
+    :return: ndarray of the elements for which the predicate is true, over the result buffer
+    """
+    scanner = get_default_scanner(workers)
+    shared = SharedArray.copy_of(array)
+    mask = SharedArray(shared.shape, bool)
+    out = None
+    try:
+        scanner.choose_backend(shared.array)
+        bounds = _blocks(scanner, len(shared))
+        counts = scanner.run([(_evaluate_block, (shared, mask, bounds[i], bounds[i + 1], predicate))
+                               for i in range(len(bounds) - 1)])
+        offsets = scanner.scan(counts, exclusive=True)
+        # the scan of the counts picks the pool for its own size
+        scanner.choose_backend(shared.array)
+        out = SharedArray(sum(counts), shared.dtype)
+        scanner.run([(_compact_block, (shared, mask, out, bounds[i], bounds[i + 1], offsets[i]))
+                      for i in range(len(bounds) - 1)])
+        return out.detach()
+    finally:
+        shared.unlink()
+        mask.unlink()
+        if out is not None:
+            out.unlink()
+
+
+def _count_buckets(scanner, shared, num_buckets, key):
+    """
+    Counts elements of the shared array per bucket and per block.
+    :return: bounds of the blocks, ndarray of counts of shape (blocks, num_buckets)
+    """
+    bounds = _blocks(scanner, len(shared))
+    counts = SharedArray((len(bounds) - 1, num_buckets), np.int64)
+    try:
+        scanner.run([(_count_block, (shared, counts, i, bounds[i], bounds[i + 1], key))
+                      for i in range(len(bounds) - 1)])
+        return bounds, counts.detach()
+    finally:
+        counts.unlink()
+
+
+def parallel_histogram(keys, num_buckets, key=None, workers=None):
+    """
+    Counts elements per bucket: every worker writes the counts of its block to its row
+    of a preallocated shared array, which are summed up.
+    :param keys: list or ndarray of bucket numbers in [0, num_buckets) or of anything key maps to them
+    :param num_buckets: number of buckets
+    :param key: function of a block returning the bucket numbers of its elements, must be picklable
+    :param workers: maximum number of workers, defaults to number of CPUs
+    :return: ndarray of num_buckets counts
+    """
+    scanner = get_default_scanner(workers)
+    shared = SharedArray.copy_of(keys)
+    try:
+        scanner.choose_backend(shared.array)
+        _, counts = _count_buckets(scanner, shared, num_buckets, key)
+        return counts.sum(axis=0)
+    finally:
+        shared.unlink()
+
+
+def parallel_partition(keys, num_buckets, key=None, workers=None):
+    """
+    Stable counting-sort partition: elements are counted per bucket and block, the counts are scanned
+    in bucket-major order into the offset of every (bucket, block) pair in the output and every worker
+    scatters its block to the preallocated shared output.
+    :param keys: list or ndarray of bucket numbers in [0, num_buckets) or of anything key maps to them
+    :param num_buckets: number of buckets
+    :param key: function of a block returning the bucket numbers of its elements, must be picklable
+    :param workers: maximum number of workers, defaults to number of CPUs
+    :return: (ndarray of the elements grouped by bucket over the result buffer,
+              ndarray of num_buckets + 1 offsets: bucket b is [offsets[b], offsets[b + 1]))
+    """
+    scanner = get_default_scanner(workers)
+    shared = SharedArray.copy_of(keys)
+    out = SharedArray(shared.shape, shared.dtype)
+    try:
+        scanner.choose_backend(shared.array)
+        bounds, counts = _count_buckets(scanner, shared, num_buckets, key)
+        # offsets[i][b] - where bucket b of block i goes: after all buckets < b and bucket b of blocks < i
+        offsets = scanner.scan(counts.T.ravel(), exclusive=True).reshape(num_buckets, -1).T
+        # the scan of the counts picks the pool for its own size
+        scanner.choose_backend(shared.array)
+        scanner.run([(_partition_block, (shared, out, bounds[i], bounds[i + 1], offsets[i], key))
+                      for i in range(len(bounds) - 1)])
+        bucket_offsets = np.append(offsets[0], len(shared))
+        return out.detach(), bucket_offsets
+    finally:
+        shared.unlink()
+        out.unlink()
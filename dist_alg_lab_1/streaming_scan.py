@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+
+from parallel_scan import as_ufunc, combine
+
+
+class StreamingScanner(object):
+    """
+    Inclusive scan of a stream which comes in chunks. Only the running total is carried from one chunk
+    to the next, so appending a chunk takes time proportional to its length. Results are written to
+    a memory-mapped output file, so neither the input nor the output has to fit in memory. If the output
+    file exists, the scan continues after its last value, so an append-only input can be rescanned
+    by consuming only the part of it which was appended since.
+    """
+    def __init__(self, output_path=None, dtype=np.int64, op='sum', chunk_size=2 ** 22, scanner=None):
+        """
+        :param output_path: raw binary file of the results, they are only returned by append() if None
+        :param dtype: dtype of the results
+        :param op: 'sum', 'product', 'max', 'min' or a ufunc of two arguments, see parallel_scan.scan
+        :param chunk_size: number of elements read at a time by consume_file()
+        :param scanner: ParallelScanner to scan large chunks with, they are scanned in the calling process if None
+        """
+        self.output_path = output_path
+        self.dtype = np.dtype(dtype)
+        self.op = op
+        self.chunk_size = chunk_size
+        self.scanner = scanner
+        self.count = 0
+        self.total = None
+        if output_path is not None and os.path.exists(output_path):
+            self.count = os.path.getsize(output_path) // self.dtype.itemsize
+            if self.count:
+                self.total = self.result()[-1]
+
+    def __len__(self):
+        return self.count
+
+    def _output(self, length):
+        """
+        Extends the output file by length elements and maps only the new part of it.
+        """
+        if not os.path.exists(self.output_path):
+            open(self.output_path, 'wb').close()
+        os.truncate(self.output_path, (self.count + length) * self.dtype.itemsize)
+        return np.memmap(self.output_path, dtype=self.dtype, mode='r+',
+                         offset=self.count * self.dtype.itemsize, shape=(length,))
+
+    def append(self, chunk):
+        """
+        Scans the next chunk of the stream.
+        :param chunk: list or ndarray of values
+        :return: scanned values of the chunk, a view of the output file if there is one
+        """
+        values = np.asarray(chunk, dtype=self.dtype)
+        if not len(values):
+            return values
+        if self.scanner is not None:
+            scanned = self.scanner.scan(values, self.op)
+        else:
+            scanned = values.copy() if self.output_path is None else values
+        if self.output_path is not None:
+            out = self._output(len(values))
+            out[...] = scanned
+            scanned = out
+        op = as_ufunc(self.op)
+        if self.scanner is None:
+            op.accumulate(scanned, out=scanned)
+        if self.total is not None:
+            combine(op, self.total, scanned)
+        if self.output_path is not None:
+            scanned.flush()
+        self.count += len(scanned)
+        self.total = scanned[-1]
+        return scanned
+
+    def consume(self, chunks):
+        """
+        Scans all chunks of an iterator.
+        :param chunks: iterable of lists or ndarrays
+        :return: total of the stream so far
+        """
+        for chunk in chunks:
+            self.append(chunk)
+        return self.total
+
+    def consume_file(self, input_path, dtype=None):
+        """
+        Scans the elements of a raw binary input file after the first len(self) ones, which are
+        already scanned, chunk_size elements at a time through a memory map.
+        :param input_path: file of values written like ndarray.tofile()
+        :param dtype: dtype of the values in the file, defaults to the dtype of the results
+        :return: total of the stream so far
+        """
+        dtype = np.dtype(dtype or self.dtype)
+        length = os.path.getsize(input_path) // dtype.itemsize
+        if length <= self.count:
+            return self.total
+        values = np.memmap(input_path, dtype=dtype, mode='r', shape=(length,))
+        for start in range(self.count, length, self.chunk_size):
+            self.append(values[start:start + self.chunk_size])
+        del values
+        return self.total
+
+    def result(self):
+        """
+        :return: read-only memory map of all the results in the output file
+        """
+        if self.output_path is None:
+            raise ValueError("StreamingScanner without an output file doesn't keep the results, "
+                             "use the values returned by append()")
+        if not self.count:
+            return np.zeros(0, dtype=self.dtype)
+        return np.memmap(self.output_path, dtype=self.dtype, mode='r', shape=(self.count,))
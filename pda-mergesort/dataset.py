@@ -0,0 +1,250 @@
+"""
+Chunked binary format of typed arrays, for inputs and results of the algorithms:
+
+    dataset.write('digits.ds', digits, compression='zlib')
+    digits = dataset.Dataset('digits.ds')
+
+A file starts with a fixed header (length, chunk length, offsets of the data and of the chunk index),
+followed by the dtype and the shape of a record as JSON. The data starts at an aligned offset, it is a sequence
+of chunks of chunk_length records, compressed one by one if a compression is given. The index at the end
+holds the offset, the stored size and the number of records of every chunk. Uncompressed data is contiguous,
+so the whole array or any chunk of it is a memory map of the file without a copy.
+"""
+import json
+import lzma
+import struct
+import zlib
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+_MAGIC = b'PDDS'
+_VERSION = 1
+# magic, version, reserved, length, chunk length, offset of the index, offset of the data, size of the metadata
+_HEADER = struct.Struct('<4sB3xQQQQI')
+_ALIGNMENT = 64
+_INDEX_DTYPE = np.dtype([('offset', '<u8'), ('size', '<u8'), ('length', '<u8')])
+
+# name -> (compress, decompress)
+COMPRESSIONS = {
+    'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+
+class DatasetWriter(object):
+    """
+    Writes a dataset chunk by chunk, appended values are buffered until a chunk is full, so an output
+    of any size is written with the memory of a single chunk. The header is completed by close().
+    """
+    def __init__(self, path, dtype, shape=(), chunk_length=2 ** 20, compression=None):
+        """
+        :param path: path to the file, it is overwritten
+        :param dtype: dtype of the records, anything but Python objects
+        :param shape: shape of a record, () for scalars
+        :param chunk_length: number of records in a chunk
+        :param compression: None, 'zlib' or 'lzma'
+        """
+        self.dtype = np.dtype(dtype)
+        if self.dtype.hasobject:
+            raise TypeError("datasets can't hold Python objects, got {0}".format(self.dtype))
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError("unknown compression {0}, use one of {1}".format(compression, sorted(COMPRESSIONS)))
+        self.path = path
+        self.shape = tuple(shape)
+        self.chunk_length = max(int(chunk_length), 1)
+        self.compression = compression
+        self.length = 0
+        self._index = []
+        self._buffer = []
+        self._buffered = 0
+        meta = json.dumps({'descr': npy_format.dtype_to_descr(self.dtype), 'shape': self.shape,
+                           'compression': compression}).encode('utf-8')
+        self._meta_size = len(meta)
+        self._data_offset = -(-(_HEADER.size + len(meta)) // _ALIGNMENT) * _ALIGNMENT
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION, 0, self.chunk_length, 0, self._data_offset, len(meta)))
+        self._file.write(meta)
+        self._file.seek(self._data_offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, values):
+        """
+        Appends records, values is an array of them or anything np.asarray turns into one.
+        """
+        values = np.asarray(values, dtype=self.dtype).reshape((-1,) + self.shape)
+        while len(values):
+            taken = values[:self.chunk_length - self._buffered]
+            self._buffer.append(taken)
+            self._buffered += len(taken)
+            values = values[len(taken):]
+            if self._buffered == self.chunk_length:
+                self._flush()
+
+    def _flush(self):
+        if not self._buffered:
+            return
+        chunk = np.ascontiguousarray(np.concatenate(self._buffer) if len(self._buffer) > 1 else self._buffer[0])
+        data = chunk.reshape(-1).view(np.uint8)
+        if self.compression is not None:
+            data = COMPRESSIONS[self.compression][0](data)
+        self._index.append((self._file.tell(), len(data), len(chunk)))
+        self._file.write(data)
+        self.length += len(chunk)
+        self._buffer = []
+        self._buffered = 0
+
+    def close(self):
+        """
+        Writes the last chunk and the index and completes the header.
+        """
+        if self._file is None:
+            return
+        self._flush()
+        index_offset = self._file.tell()
+        self._file.write(np.array(self._index, dtype=_INDEX_DTYPE).tobytes())
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION, self.length, self.chunk_length, index_offset,
+                                      self._data_offset, self._meta_size))
+        self._file.close()
+        self._file = None
+
+
+def write(path, data, chunk_length=2 ** 20, compression=None):
+    """
+    Writes an array to a dataset file.
+    :param data: ndarray or anything np.asarray accepts, records are the elements along the first axis
+    :param compression: None, 'zlib' or 'lzma'
+    :return: Dataset of the file
+    """
+    data = np.asarray(data)
+    if not data.ndim:
+        data = data.reshape(1)
+    with DatasetWriter(path, data.dtype, data.shape[1:], chunk_length, compression) as writer:
+        writer.append(data)
+    return Dataset(path)
+
+
+def write_fields(path, fields, chunk_length=2 ** 20, compression=None):
+    """
+    Writes columns of equal length as records with a field per column.
+    :param fields: list of (name, column), the columns are arrays or anything np.asarray accepts
+    :return: Dataset of the file
+    """
+    columns = [(name, np.asarray(column)) for name, column in fields]
+    records = np.empty(len(columns[0][1]), [(name, column.dtype, column.shape[1:]) for name, column in columns])
+    for name, column in columns:
+        records[name] = column
+    return write(path, records, chunk_length, compression)
+
+
+def write_pairs(path, pairs, chunk_length=2 ** 20, compression=None):
+    """
+    Writes (key, value) pairs, like the result of a MapReduce job, as records with the fields key and value.
+    :return: Dataset of the file
+    """
+    pairs = list(pairs)
+    return write_fields(path, [('key', [key for key, _ in pairs]), ('value', [value for _, value in pairs])],
+                        chunk_length, compression)
+
+
+class Dataset(object):
+    """
+    Reader of a dataset file. It behaves like a read-only array: len, indexing, iteration over the records
+    and np.asarray work on it, so it can be passed as input to the sorts, scans and MapReduce. Uncompressed
+    data is memory-mapped without a copy, compressed data is decompressed chunk by chunk, see chunks().
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size or header[:4] != _MAGIC:
+                raise ValueError("{0} is not a dataset file".format(path))
+            magic, version, self.length, self.chunk_length, index_offset, self._data_offset, meta_size = \
+                _HEADER.unpack(header)
+            if version > _VERSION:
+                raise ValueError("{0} is of a newer version {1} of the dataset format".format(path, version))
+            meta = json.loads(f.read(meta_size).decode('utf-8'))
+            f.seek(index_offset)
+            self.index = np.frombuffer(f.read(), _INDEX_DTYPE)
+        self.dtype = npy_format.descr_to_dtype(meta['descr'])
+        self.shape = (self.length,) + tuple(meta['shape'])
+        self.compression = meta['compression']
+        # index of the first record of every chunk
+        self.starts = np.concatenate(([0], np.cumsum(self.index['length']))).astype(np.int64)
+        self._array = None
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return "Dataset({0!r}, length={1}, dtype={2}, chunks={3}, compression={4})".format(
+            self.path, self.length, self.dtype, self.num_chunks, self.compression)
+
+    @property
+    def num_chunks(self):
+        return len(self.index)
+
+    def raw_chunk(self, i):
+        """
+        :return: bytes of chunk i as they are stored in the file
+        """
+        offset, size, _ = self.index[i]
+        with open(self.path, 'rb') as f:
+            f.seek(int(offset))
+            return f.read(int(size))
+
+    def chunk(self, i):
+        """
+        :return: records of chunk i, a view of the memory map if the data isn't compressed
+        """
+        if self.compression is None:
+            return self.read()[self.starts[i]:self.starts[i + 1]]
+        data = COMPRESSIONS[self.compression][1](self.raw_chunk(i))
+        return np.frombuffer(data, self.dtype).reshape((-1,) + self.shape[1:])
+
+    def chunks(self):
+        """
+        Iterates over the chunks, compressed data is decompressed one chunk at a time.
+        """
+        for i in range(self.num_chunks):
+            yield self.chunk(i)
+
+    def __iter__(self):
+        """
+        Iterates over the records, like over an array, reading them a chunk at a time.
+        """
+        for chunk in self.chunks():
+            yield from chunk
+
+    def read(self):
+        """
+        :return: all the records, a read-only memory map of the file if the data isn't compressed
+        """
+        if self._array is None:
+            if self.compression is None:
+                if self.length:
+                    self._array = np.memmap(self.path, self.dtype, 'r', self._data_offset, self.shape)
+                else:
+                    self._array = np.empty(self.shape, self.dtype)
+            else:
+                self._array = np.empty(self.shape, self.dtype)
+                start = 0
+                for chunk in self.chunks():
+                    self._array[start:start + len(chunk)] = chunk
+                    start += len(chunk)
+        return self._array
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.read()
+        if dtype is not None:
+            return array.astype(dtype)
+        return array.copy() if copy else array
+
+    def __getitem__(self, item):
+        return self.read()[item]
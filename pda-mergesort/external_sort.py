@@ -0,0 +1,182 @@
+"""
+Sorts binary files larger than memory. The input is a raw file of records of a NumPy dtype, without a header:
+
+    external_sort('input.bin', 'sorted.bin', np.int64, memory_limit=2 ** 30)
+
+Runs of the input which fit in the memory budget are sorted by the workers and written to temporary files,
+then the runs are merged by k-way merges into a memory-mapped output file. The last merge is split by splitters
+sampled from the runs, every worker merges its range of values from all the runs into its range of the output.
+If there are too many runs to give each of them a large enough buffer, groups of runs are first merged
+into longer runs in parallel. All reads and writes are sequential and go in large blocks.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import tracing
+from parallel_sort import get_default_sorter
+
+# smallest buffer in bytes a run is read with, runs are merged in several passes rather than with smaller buffers
+_MIN_BUFFER = 2 ** 16
+
+
+def _read(path, dtype, start, count):
+    """
+    Reads count records of dtype from start of the binary file.
+    """
+    with open(path, 'rb') as file:
+        file.seek(start * np.dtype(dtype).itemsize)
+        return np.fromfile(file, dtype, count)
+
+
+def _sort_run(input_path, dtype, start, stop, run_path):
+    """
+    Sorts records [start, stop) of the input file and writes them to the run file.
+    """
+    run = _read(input_path, dtype, start, stop - start)
+    run.sort(kind='stable')
+    run.tofile(run_path)
+
+
+def _merge_runs(run_paths, dtype, starts, ends, output_path, out_start, buffer_size):
+    """
+    Merges ranges [starts[r], ends[r]) of the sorted run files into the output file from out_start.
+    Every run is read in blocks of buffer_size records. All the buffered records up to the smallest
+    last record of the buffers are merged by the stable sort of NumPy, which finds them as presorted runs,
+    and written out, then the buffers which are used up are refilled.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    length = sum(end - start for start, end in zip(starts, ends))
+    output = np.memmap(output_path, dtype, 'r+', out_start * itemsize, length)
+    files = [open(path, 'rb') for path in run_paths]
+    try:
+        positions = list(starts)
+        buffers = [None] * len(files)
+        written = 0
+        while True:
+            for r, file in enumerate(files):
+                if (buffers[r] is None or not len(buffers[r])) and positions[r] < ends[r]:
+                    file.seek(positions[r] * itemsize)
+                    buffers[r] = np.fromfile(file, dtype, min(buffer_size, ends[r] - positions[r]))
+                    positions[r] += len(buffers[r])
+            live = [r for r in range(len(files)) if buffers[r] is not None and len(buffers[r])]
+            if not live:
+                break
+            # records up to the limit can't be preceded by any record which is not read yet
+            lasts = [buffers[r][-1:] for r in live if positions[r] < ends[r]]
+            limit = np.sort(np.concatenate(lasts))[:1] if lasts else None
+            batch = []
+            for r in live:
+                count = len(buffers[r]) if limit is None else int(np.searchsorted(buffers[r], limit, side='right')[0])
+                batch.append(buffers[r][:count])
+                buffers[r] = buffers[r][count:]
+            batch = np.concatenate(batch)
+            batch.sort(kind='stable')
+            output[written:written + len(batch)] = batch
+            written += len(batch)
+        output.flush()
+    finally:
+        del output
+        for file in files:
+            file.close()
+
+
+def _allocate(path, size):
+    """
+    Creates the file of size bytes at once, workers write their ranges of it through memory maps.
+    """
+    with open(path, 'wb') as file:
+        file.truncate(size)
+
+
+def _merge_passes(sorter, run_paths, lengths, dtype, memory_limit, run_dir, verbose=False):
+    """
+    Merges groups of runs into longer runs until there are few enough of them for the final merge.
+    :return: paths and lengths of the remaining runs
+    """
+    workers = sorter.workers
+    fan_in = max(memory_limit // (2 * workers * max(_MIN_BUFFER, dtype.itemsize)), 2)
+    level = 0
+    while len(run_paths) > fan_in:
+        tasks = []
+        merged_paths, merged_lengths = [], []
+        for i in range(0, len(run_paths), fan_in):
+            paths, group = run_paths[i:i + fan_in], lengths[i:i + fan_in]
+            merged_paths.append(os.path.join(run_dir, 'run-{0}-{1}.bin'.format(level + 1, len(merged_paths))))
+            merged_lengths.append(sum(group))
+            _allocate(merged_paths[-1], merged_lengths[-1] * dtype.itemsize)
+            buffer_size = max(memory_limit // (2 * dtype.itemsize * workers * len(paths)), 1)
+            tasks.append((_merge_runs, (paths, dtype, [0] * len(paths), group, merged_paths[-1], 0, buffer_size)))
+        with tracing.span('merge pass', 'sort', level=level, runs=len(run_paths)):
+            sorter.run(tasks)
+        if verbose:
+            print("Merge pass {0}: {1} runs are merged into {2}".format(level, len(run_paths), len(merged_paths)))
+        for path in run_paths:
+            os.remove(path)
+        run_paths, lengths = merged_paths, merged_lengths
+        level += 1
+    return run_paths, lengths
+
+
+def external_sort(input_path, output_path, dtype, memory_limit=2 ** 28, workers=None, backend='auto',
+                  tmp_dir=None, oversampling=32, verbose=False):
+    """
+    Sorts a binary file of records of dtype, which may be larger than memory, in parallel.
+    :param input_path: raw binary file of records, e.g. written by ndarray.tofile
+    :param output_path: file the sorted records are written to, in the same format
+    :param dtype: NumPy dtype of the records, structured records are sorted by their fields in order
+    :param memory_limit: bytes of records all the workers hold in memory at a time, it sets the size of
+                         the runs and of the merge buffers
+    :param workers: maximum number of workers, defaults to number of CPUs
+    :param backend: 'serial', 'thread', 'process' or 'auto', see executors.BACKENDS
+    :param tmp_dir: directory for the sorted runs, defaults to the directory of the output file
+    :param oversampling: number of samples taken from every run per worker to split the merge
+    :return: read-only np.memmap of the sorted output
+    """
+    dtype = np.dtype(dtype)
+    length = os.path.getsize(input_path) // dtype.itemsize
+    sorter = get_default_sorter(workers, backend)
+    sorter.choose_backend(np.memmap(input_path, dtype, 'r', shape=(length,)) if length else np.empty(0, dtype))
+    workers = sorter.workers
+    run_size = max(memory_limit // (dtype.itemsize * workers), 1)
+    bounds = list(range(0, length, run_size)) + [length]
+    run_dir = tempfile.mkdtemp(prefix='runs-', dir=tmp_dir or os.path.dirname(os.path.abspath(output_path)))
+    try:
+        run_paths = [os.path.join(run_dir, 'run-0-{0}.bin'.format(i)) for i in range(len(bounds) - 1)]
+        with tracing.span('sort runs', 'sort', runs=len(run_paths)):
+            sorter.run([(_sort_run, (input_path, dtype, bounds[i], bounds[i + 1], run_paths[i]))
+                         for i in range(len(run_paths))])
+        if verbose:
+            print("Input of {0} records is sorted in {1} runs of {2} records".format(length, len(run_paths), run_size))
+        _allocate(output_path, length * dtype.itemsize)
+        if not length:
+            return np.empty(0, dtype)
+        run_paths, lengths = _merge_passes(sorter, run_paths, np.diff(bounds).tolist(), dtype, memory_limit, run_dir,
+                                           verbose)
+        runs = [np.memmap(path, dtype, 'r', shape=(lengths[i],)) for i, path in enumerate(run_paths)]
+        step = max(length // (len(runs) * workers * oversampling), 1)
+        sample = np.sort(np.concatenate([run[::step] for run in runs]))
+        parts = max(min(workers, len(sample)), 1)
+        splitters = sample[[len(sample) * part // parts for part in range(1, parts)]]
+        positions = [np.concatenate(([0], np.searchsorted(run, splitters, side='left'), [len(run)])) for run in runs]
+        del runs
+        buffer_size = max(memory_limit // (2 * dtype.itemsize * workers * len(run_paths)), 1)
+        tasks = []
+        out_start = 0
+        for part in range(parts):
+            starts = [int(position[part]) for position in positions]
+            ends = [int(position[part + 1]) for position in positions]
+            size = sum(end - start for start, end in zip(starts, ends))
+            if size:
+                tasks.append((_merge_runs, (run_paths, dtype, starts, ends, output_path, out_start, buffer_size)))
+            out_start += size
+        with tracing.span('k-way merge', 'sort', runs=len(run_paths), parts=parts):
+            sorter.run(tasks)
+        if verbose:
+            print("{0} runs are merged by {1} workers with buffers of {2} records".format(len(run_paths), parts,
+                                                                                         buffer_size))
+        return np.memmap(output_path, dtype, 'r', shape=(length,))
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
@@ -4,9 +4,11 @@ import multiprocessing
 import random
 import sys
 import time
-import matplotlib.pyplot as plt
+import numpy as np
 
+import tracing
 from console_output_to_file import copyConsoleToFile
+from parallel_sort import pooled_kway_merge_sort, pooled_merge_sort, pooled_radix_sort, pooled_sample_sort
 
 
 def merge(*args):
@@ -115,13 +117,13 @@ def _merge_using_binary_search(l, r):
 def parallel_merge_sort(input, verbose=False):
     """
     Performs parallel merge sort multiple processes
-    :param input: list of input elements
+    :param input: list of input elements, numbers of a single type (ints or floats)
     :return: sorted list
     """
     max_cores = multiprocessing.cpu_count()
-    jobs = []
     length = len(input)
-    shared_array = multiprocessing.Array('i', input)
+    # typecode of the input, so that 64-bit ints and floats aren't truncated
+    shared_array = multiprocessing.Array(np.asarray(input).dtype.char, input)
     depth = math.log(length, 2)
     for level in range(0, int(depth)):
         if verbose:
@@ -131,13 +133,16 @@ def parallel_merge_sort(input, verbose=False):
         if core_number > max_cores:
             core_number = max_cores
             processing_field_size = int(length / core_number)
-        for i in range(core_number):
-            p = multiprocessing.Process(target=_parallel_merger, args=(shared_array, level, i, processing_field_size, verbose))
-            p.daemon = False
-            jobs.append(p)
-            p.start()
-        for p in jobs:
-            p.join()
+        # processes of this level, the ones of the previous levels are already joined
+        jobs = []
+        with tracing.span('merge level', 'sort', level=level, workers=core_number):
+            for i in range(core_number):
+                p = multiprocessing.Process(target=_parallel_merger, args=(shared_array, level, i, processing_field_size, verbose))
+                p.daemon = False
+                jobs.append(p)
+                p.start()
+            for p in jobs:
+                p.join()
         if (verbose):
             print("Current state of array:")
             print(shared_array[:])
@@ -145,6 +150,9 @@ def parallel_merge_sort(input, verbose=False):
 
 
 if __name__ == "__main__":
+    # only the plots need matplotlib, the functions are imported by the benchmarks
+    import matplotlib.pyplot as plt
+
     random.seed(128)
 
     run_single_time =  not True
@@ -156,7 +164,8 @@ if __name__ == "__main__":
         gen_data_margin = size
         data_unsorted = random.sample(range(size), size)
         print("Generated unsorted data:\n", data_unsorted)
-        for sort in sequential_merge_sort, parallel_naive_merge_sort, parallel_merge_sort:
+        for sort in (sequential_merge_sort, parallel_naive_merge_sort, parallel_merge_sort, pooled_merge_sort,
+                     pooled_kway_merge_sort, pooled_sample_sort, pooled_radix_sort):
             start = time.time()
             data_sorted = sort(data_unsorted, True)
             print(data_sorted)
@@ -170,11 +179,13 @@ if __name__ == "__main__":
         time_sequential = []
         time_naive_parallel = []
         time_parallel = []
-        execution_time = [[],[],[]]
+        execution_time = [[],[],[],[],[],[],[]]
 
         for size in sizes:
             data_unsorted = random.sample(range(size), size)
-            for i, sort in enumerate((sequential_merge_sort, parallel_naive_merge_sort, parallel_merge_sort)):
+            for i, sort in enumerate((sequential_merge_sort, parallel_naive_merge_sort, parallel_merge_sort,
+                                      pooled_merge_sort, pooled_kway_merge_sort, pooled_sample_sort,
+                                      pooled_radix_sort)):
                 start = time.time()
                 data_sorted = sort(data_unsorted)
                 time_taken = time.time() - start
@@ -185,7 +196,12 @@ if __name__ == "__main__":
         plt.plot(powers, execution_time[0])
         plt.plot(powers, execution_time[1])
         plt.plot(powers, execution_time[2])
-        plt.legend(["Sequential", "Naive parallel", "Parallel"], loc=2)
+        plt.plot(powers, execution_time[3])
+        plt.plot(powers, execution_time[4])
+        plt.plot(powers, execution_time[5])
+        plt.plot(powers, execution_time[6])
+        plt.legend(["Sequential", "Naive parallel", "Parallel", "Pooled parallel", "Pooled k-way", "Pooled sample",
+                    "Pooled radix"], loc=2)
         plt.xlabel("Input size: 2^x")
         plt.ylabel("Execution time")
         plt.savefig('result.png')
@@ -0,0 +1,591 @@
+import atexit
+import math
+import multiprocessing
+
+import numpy as np
+
+import dataset
+import executors
+import tracing
+from shared_array import SharedArray
+
+
+def _merge(left, right, out):
+    """
+    Merges sorted arrays left and right into out of size len(left) + len(right).
+    Position of every element of right is found by binary search in left, elements of right
+    go after the equal elements of left, so the merge is stable.
+    """
+    positions = np.searchsorted(left, right, side='right')
+    positions += np.arange(len(right))
+    taken = np.zeros(len(out), dtype=bool)
+    taken[positions] = True
+    out[positions] = right
+    out[~taken] = left
+
+
+def _co_rank(k, left, right):
+    """
+    Finds the split of the merge path: how many elements of left are among the first k elements
+    of the stable merge of left and right, by binary search.
+    :return: i, so that the first k merged elements are left[:i] and right[:k - i]
+    """
+    lo, hi = max(0, k - len(right)), min(k, len(left))
+    while lo < hi:
+        i = (lo + hi) // 2
+        # right[k - i - 1] >= left[i], searchsorted compares records of structured dtypes too
+        if np.searchsorted(left[i:i + 1], right[k - i - 1:k - i], side='right')[0]:
+            lo = i + 1
+        else:
+            hi = i
+    return lo
+
+
+def _merge_path_tasks(src, dst, lbound, middle, rbound, parts):
+    """
+    Splits merge of runs [lbound, middle) and [middle, rbound) of src into parts independent sub-merges
+    of equal output size, the split points are found with _co_rank.
+    :return: list of _merge_ranges tasks
+    """
+    left, right = src.array[lbound:middle], src.array[middle:rbound]
+    total = rbound - lbound
+    tasks = []
+    i_start = j_start = 0
+    for part in range(1, parts + 1):
+        k = total * part // parts
+        i_end = _co_rank(k, left, right)
+        j_end = k - i_end
+        if i_end + j_end > i_start + j_start:
+            tasks.append((_merge_ranges, (src, dst, lbound + i_start, lbound + i_end,
+                                          middle + j_start, middle + j_end, lbound + i_start + j_start)))
+        i_start, j_start = i_end, j_end
+    return tasks
+
+
+def _sort_block(shared, lbound, rbound):
+    """
+    Sorts indices [lbound, rbound) of the shared array in place.
+    """
+    try:
+        shared.array[lbound:rbound].sort(kind='stable')
+    finally:
+        shared.close()
+
+
+def _merge_ranges(src, dst, left_start, left_end, right_start, right_end, out_start):
+    """
+    Merges sorted ranges [left_start, left_end) and [right_start, right_end) of src into dst from out_start.
+    """
+    try:
+        out_end = out_start + (left_end - left_start) + (right_end - right_start)
+        _merge(src.array[left_start:left_end], src.array[right_start:right_end], dst.array[out_start:out_end])
+    finally:
+        src.close()
+        dst.close()
+
+
+def _kway_merge_ranges(src, dst, starts, ends, out_start):
+    """
+    Merges ranges [starts[r], ends[r]) of k sorted runs of src into dst from out_start: the ranges are copied
+    next to each other and sorted by the stable sort of NumPy. It isn't a heap or tournament tree merge,
+    the stable sort is timsort, which finds the ranges as presorted runs and merges them pairwise, or a radix
+    sort for integers of 16 bits or less. Either is much faster than merging element by element in Python.
+    """
+    try:
+        out = dst.array[out_start:out_start + sum(end - start for start, end in zip(starts, ends))]
+        position = 0
+        for start, end in zip(starts, ends):
+            out[position:position + end - start] = src.array[start:end]
+            position += end - start
+        out.sort(kind='stable')
+        del out
+    finally:
+        src.close()
+        dst.close()
+
+
+def _sort_and_split_block(shared, lbound, rbound, splitters):
+    """
+    Sorts indices [lbound, rbound) of the shared array in place and finds the buckets of sample sort in it.
+    :return: edges of the buckets in the block, bucket p is [edges[p], edges[p + 1])
+    """
+    try:
+        block = shared.array[lbound:rbound]
+        block.sort(kind='stable')
+        edges = np.concatenate(([0], np.searchsorted(block, splitters, side='right'), [len(block)]))
+        del block
+        return edges
+    finally:
+        shared.close()
+
+
+def _exchange_buckets(src, dst, lbound, edges, offsets):
+    """
+    Copies every bucket of a block of src to the place of the bucket from this block in dst.
+    """
+    try:
+        for bucket in range(len(offsets)):
+            size = edges[bucket + 1] - edges[bucket]
+            dst.array[offsets[bucket]:offsets[bucket] + size] = \
+                src.array[lbound + edges[bucket]:lbound + edges[bucket + 1]]
+    finally:
+        src.close()
+        dst.close()
+
+
+def _radix_digits(values, shift, flip):
+    """
+    Takes 8 bits of every value starting from shift. For the highest digit of signed values the sign bit
+    is flipped, so that negative values go first. Records sorted by key are taken by their key.
+    """
+    if values.dtype.names:
+        values = values['key']
+    unsigned = values.view('u{0}'.format(values.dtype.itemsize))
+    digits = ((unsigned >> shift) & 0xFF).astype(np.uint8)
+    if flip:
+        digits ^= 0x80
+    return digits
+
+
+def _radix_histogram(shared, lbound, rbound, shift, flip):
+    """
+    Counts values of a block of the shared array per digit.
+    """
+    try:
+        return np.bincount(_radix_digits(shared.array[lbound:rbound], shift, flip), minlength=256)
+    finally:
+        shared.close()
+
+
+def _radix_scatter(src, dst, lbound, rbound, shift, flip, offsets):
+    """
+    Moves values of a block of src to dst: a value with digit d goes to offsets[d] plus the number
+    of values with digit d before it in the block, which keeps the sort stable.
+    """
+    try:
+        block = src.array[lbound:rbound]
+        digits = _radix_digits(block, shift, flip)
+        order = np.argsort(digits, kind='stable')
+        counts = np.bincount(digits, minlength=256)
+        sorted_digits = digits[order]
+        positions = offsets[sorted_digits] + np.arange(len(block)) - (np.cumsum(counts) - counts)[sorted_digits]
+        dst.array[positions] = block[order]
+        del block
+    finally:
+        src.close()
+        dst.close()
+
+
+def _copy_block(src, dst, lbound, rbound):
+    """
+    Copies a run without a pair on the current level from src to dst.
+    """
+    try:
+        dst.array[lbound:rbound] = src.array[lbound:rbound]
+    finally:
+        src.close()
+        dst.close()
+
+
+class ParallelSorter(object):
+    """
+    Sorts arrays in shared memory with a persistent pool of workers, which is started lazily
+    and reused by all the sorts until close() is called. Workers are processes, threads or the calling
+    process itself, depending on the backend (see executors.BACKENDS).
+    """
+    def __init__(self, num_workers=None, backend='process'):
+        """
+        :param num_workers: size of the worker pool, defaults to number of CPUs or to the size of the backend pool
+        :param backend: 'serial', 'thread', 'process' or 'auto' to pick the backend and the number of workers
+                        for every sort from the size of its input (see executors.choose_backend).
+                        It can also be a pool object with apply_async, which is used as it is and not closed
+                        by close()
+        """
+        self.num_workers = num_workers or getattr(backend, 'num_workers', None) or multiprocessing.cpu_count()
+        self.backend = backend
+        # (backend, number of workers) -> pool, 'auto' may use several of them
+        self._pools = {}
+        self._pool = None
+        # size of the current pool, the work is split into this many blocks
+        self._workers = self.num_workers
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self, backend=None, num_workers=None):
+        """
+        Starts the pool of the backend, the configured one by default. With the 'auto' backend
+        pools are started when a sort picks them.
+        """
+        backend = backend or self.backend
+        if backend == 'auto':
+            return self
+        if not isinstance(backend, str):
+            self._pool = backend
+            self._workers = self.num_workers
+            return self
+        key = backend, num_workers or self.num_workers
+        if key not in self._pools:
+            with tracing.span('spawn', 'pool', backend=key[0], workers=key[1]):
+                self._pools[key] = executors.make_pool(*key)
+        self._pool = self._pools[key]
+        self._workers = key[1]
+        return self
+
+    @property
+    def workers(self):
+        """
+        Size of the current pool, the work of a sort is split into this many blocks.
+        """
+        return self._workers
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.close()
+            pool.join()
+        self._pools = {}
+        self._pool = None
+
+    def choose_backend(self, values):
+        """
+        With the 'auto' backend picks the pool of the next sort: small inputs are sorted serially,
+        large ones by as many threads as pay off their overhead, NumPy sorts and merges release the GIL.
+        Code running its own tasks with run() calls it first, with a sample of the data they work on.
+        """
+        if self.backend != 'auto':
+            return
+        length = len(values)
+        sample = np.asarray(values[:2 ** 12])
+        # sorting takes n log n, it is extrapolated from the time NumPy takes to sort the sample
+        scale = length * math.log2(length) / (len(sample) * math.log2(len(sample))) if len(sample) > 1 else length
+        work = executors.measure_work(np.sort, sample) * scale
+        self.start(*executors.choose_backend(work, self.num_workers, gil_free=True))
+
+    def run(self, tasks):
+        """
+        Runs (function, args) tasks in the pool and waits for all of them, which is the barrier
+        between the levels of a sort. If tracing is enabled, every task records its time in the queue
+        and in the worker. The functions have to be picklable for the process backend.
+        :return: list of the results of the tasks
+        """
+        if self._pool is None:
+            self.start('process' if self.backend == 'auto' else None)
+        results = [self._pool.apply_async(*tracing.traced(function.__name__.strip('_'), function, args))
+                   for function, args in tasks]
+        return [tracing.result(result.get()) for result in results]
+
+    @staticmethod
+    def _shared_input(data, key=None, argsort=False):
+        """
+        Copies what is sorted to shared memory: the data itself or, if it is sorted by a key or only
+        the permutation is needed, (key, index) records. Equal keys are ordered by the index in records,
+        so every sort of them is stable.
+        """
+        if key is None and not argsort:
+            with tracing.span('copy to shared memory', 'sort'):
+                return SharedArray.copy_of(data)
+        data = np.asarray(data)
+        keys = data if key is None else data[key] if isinstance(key, str) else np.asarray(key(data))
+        shared = SharedArray(len(data), [('key', keys.dtype, keys.shape[1:]), ('index', np.intp)])
+        shared.array['key'] = keys
+        shared.array['index'] = np.arange(len(data))
+        return shared
+
+    @staticmethod
+    def _result(data, shared, key=None, argsort=False):
+        """
+        Makes the result of a sort out of the sorted shared array. An ndarray result is a view
+        of the detached block, so the sorted data is not copied.
+        """
+        if argsort:
+            return shared.array['index'].tolist() if isinstance(data, list) else shared.detach()['index']
+        if key is not None:
+            result = np.asarray(data)[shared.array['index']]
+            return result.tolist() if isinstance(data, list) else result
+        return shared.array.tolist() if isinstance(data, list) else shared.detach()
+
+    def _sort_blocks(self, src):
+        """
+        Sorts num_workers contiguous blocks of the shared array in parallel.
+        :return: bounds of the blocks
+        """
+        length = len(src)
+        workers = min(self._workers, max(length, 1))
+        bounds = [length * i // workers for i in range(workers + 1)]
+        with tracing.span('sort blocks', 'sort'):
+            self.run([(_sort_block, (src, bounds[i], bounds[i + 1])) for i in range(workers)])
+        return bounds
+
+    def merge_sort(self, data, verbose=False, key=None, argsort=False):
+        """
+        Performs parallel merge sort: every worker sorts a contiguous block of the shared array,
+        then sorted runs are merged pairwise between two shared buffers, so there are only
+        log2(num_workers) merge levels and no data is sliced out of the shared memory.
+        Every merge is split along the merge path into sub-merges, so that all workers are busy
+        on the last levels too, where there are fewer pairs than workers.
+        :param data: list or ndarray of any dtype, structured arrays are sorted by their fields in order
+        :param key: name of the field of a structured array or function of the whole array returning
+                    the array of keys, the data is sorted by the keys
+        :param argsort: if True, the permutation which sorts the data is returned instead
+
+        :return: sorted list if data is a list, otherwise sorted ndarray over the result buffer
+        """
+        self.choose_backend(data)
+        src = self._shared_input(data, key, argsort)
+        dst = SharedArray(src.shape, src.dtype)
+        try:
+            bounds = self._sort_blocks(src)
+            if verbose:
+                print("Each block is now sorted.\n", src.array)
+            level = 0
+            while len(bounds) > 2:
+                tasks = []
+                merged_bounds = [bounds[0]]
+                parts = math.ceil(self._workers / ((len(bounds) - 1) // 2))
+                for i in range(0, len(bounds) - 1, 2):
+                    if i + 2 < len(bounds):
+                        tasks += _merge_path_tasks(src, dst, bounds[i], bounds[i + 1], bounds[i + 2], parts)
+                        merged_bounds.append(bounds[i + 2])
+                    else:
+                        tasks.append((_copy_block, (src, dst, bounds[i], bounds[i + 1])))
+                        merged_bounds.append(bounds[i + 1])
+                with tracing.span('merge level', 'sort', level=level, tasks=len(tasks)):
+                    self.run(tasks)
+                src, dst = dst, src
+                bounds = merged_bounds
+                if verbose:
+                    print("Level:", level)
+                    print("Current state of array:")
+                    print(src.array)
+                level += 1
+            return self._result(data, src, key, argsort)
+        finally:
+            src.unlink()
+            dst.unlink()
+
+    def kway_merge_sort(self, data, verbose=False, oversampling=32, key=None, argsort=False):
+        """
+        Performs parallel merge sort with a single k-way merge of all sorted blocks instead of pairwise levels.
+        Splitters are picked from a regular sample of the blocks, every worker merges the elements between
+        two neighbouring splitters from all blocks into its range of the output.
+        :param data: list or ndarray of any dtype
+        :param oversampling: number of samples taken from every block per worker
+        :param key: see merge_sort
+        :param argsort: see merge_sort
+        :return: sorted list if data is a list, otherwise sorted ndarray over the result buffer
+        """
+        self.choose_backend(data)
+        src = self._shared_input(data, key, argsort)
+        dst = SharedArray(src.shape, src.dtype)
+        try:
+            bounds = self._sort_blocks(src)
+            if verbose:
+                print("Each block is now sorted.\n", src.array)
+            runs = [src.array[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+            step = max(len(src) // (len(runs) * self._workers * oversampling), 1)
+            sample = np.sort(np.concatenate([run[::step] for run in runs]))
+            parts = max(min(self._workers, len(sample)), 1)
+            splitters = sample[[len(sample) * part // parts for part in range(1, parts)]]
+            positions = [np.concatenate(([0], np.searchsorted(run, splitters, side='left'), [len(run)]))
+                         for run in runs]
+            del runs
+            tasks = []
+            out_start = 0
+            for part in range(parts):
+                starts = [bounds[i] + int(positions[i][part]) for i in range(len(positions))]
+                ends = [bounds[i] + int(positions[i][part + 1]) for i in range(len(positions))]
+                tasks.append((_kway_merge_ranges, (src, dst, starts, ends, out_start)))
+                out_start += sum(end - start for start, end in zip(starts, ends))
+            with tracing.span('k-way merge', 'sort', runs=len(positions)):
+                self.run(tasks)
+            if verbose:
+                print("Merged array:")
+                print(dst.array)
+            return self._result(data, dst, key, argsort)
+        finally:
+            src.unlink()
+            dst.unlink()
+
+    def sample_sort(self, data, verbose=False, oversampling=32, key=None, argsort=False):
+        """
+        Performs parallel sample sort: splitters are picked from a random sample of the data, every worker
+        sorts its block and cuts it into buckets by the splitters, buckets are exchanged, so that bucket p
+        of every block goes next to each other, and every worker sorts one bucket.
+        :param data: list or ndarray of any dtype
+        :param oversampling: number of samples per worker
+        :param key: see merge_sort
+        :param argsort: see merge_sort
+        :return: sorted list if data is a list, otherwise sorted ndarray over the result buffer
+        """
+        self.choose_backend(data)
+        src = self._shared_input(data, key, argsort)
+        dst = SharedArray(src.shape, src.dtype)
+        try:
+            length = len(src)
+            workers = min(self._workers, max(length, 1))
+            bounds = [length * i // workers for i in range(workers + 1)]
+            sample = np.sort(src.array[np.random.randint(0, max(length, 1), workers * oversampling)]) \
+                if length else src.array[:0]
+            splitters = sample[[len(sample) * p // workers for p in range(1, workers)]]
+            with tracing.span('sort and split blocks', 'sort'):
+                edges = self.run([(_sort_and_split_block, (src, bounds[i], bounds[i + 1], splitters))
+                                   for i in range(workers)])
+            # offsets[i][p] - where bucket p of block i goes: after all buckets < p and bucket p of blocks < i
+            counts = np.diff(np.array(edges), axis=1)
+            within = np.cumsum(counts, axis=0) - counts
+            bucket_sizes = counts.sum(axis=0)
+            offsets = np.cumsum(bucket_sizes) - bucket_sizes + within
+            with tracing.span('exchange buckets', 'sort'):
+                self.run([(_exchange_buckets, (src, dst, bounds[i], edges[i], offsets[i])) for i in range(workers)])
+            if verbose:
+                print("Bucket sizes:", bucket_sizes)
+                print("Buckets after exchange:\n", dst.array)
+            bucket_bounds = np.concatenate(([0], np.cumsum(bucket_sizes)))
+            with tracing.span('sort buckets', 'sort'):
+                self.run([(_sort_block, (dst, bucket_bounds[p], bucket_bounds[p + 1])) for p in range(workers)])
+            return self._result(data, dst, key, argsort)
+        finally:
+            src.unlink()
+            dst.unlink()
+
+    def radix_sort(self, data, verbose=False, key=None, argsort=False):
+        """
+        Performs parallel LSD radix sort of integers with 8 bit digits. On every pass workers count digits
+        in their blocks, offsets of every (digit, block) pair are found by prefix sums over the counts and
+        every worker scatters its block to the other buffer. Passes in which all values have the same digit
+        are skipped.
+        :param data: list or ndarray of integers, or of anything if the key is integer
+        :param key: see merge_sort
+        :param argsort: see merge_sort
+        :return: sorted list if data is a list, otherwise sorted ndarray over the result buffer
+        """
+        self.choose_backend(data)
+        src = self._shared_input(data, key, argsort)
+        key_dtype = src.dtype['key'] if src.dtype.names else src.dtype
+        if key_dtype.kind not in 'iu' and len(src):
+            src.unlink()
+            raise TypeError("radix sort supports only integer keys, got {0}".format(key_dtype))
+        dst = SharedArray(src.shape, src.dtype)
+        try:
+            length = len(src)
+            workers = min(self._workers, max(length, 1))
+            bounds = [length * i // workers for i in range(workers + 1)]
+            # an empty list comes as a float array, there is nothing to sort in it
+            bits = key_dtype.itemsize * 8 if length else 0
+            for shift in range(0, bits, 8):
+                flip = key_dtype.kind == 'i' and shift + 8 == bits
+                with tracing.span('radix histogram', 'sort', shift=shift):
+                    counts = np.array(self.run([(_radix_histogram, (src, bounds[i], bounds[i + 1], shift, flip))
+                                                 for i in range(workers)]))
+                digit_sizes = counts.sum(axis=0)
+                if digit_sizes.max() == length:
+                    continue
+                offsets = np.cumsum(digit_sizes) - digit_sizes + np.cumsum(counts, axis=0) - counts
+                with tracing.span('radix scatter', 'sort', shift=shift):
+                    self.run([(_radix_scatter, (src, dst, bounds[i], bounds[i + 1], shift, flip, offsets[i]))
+                               for i in range(workers)])
+                src, dst = dst, src
+                if verbose:
+                    print("Digit at bit", shift)
+                    print("Current state of array:")
+                    print(src.array)
+            return self._result(data, src, key, argsort)
+        finally:
+            src.unlink()
+            dst.unlink()
+
+    def merge(self, left, right):
+        """
+        Merges two sorted sequences, the merge is split along the merge path between all workers.
+        :return: merged list if left is a list, otherwise merged ndarray over the result buffer
+        """
+        src = SharedArray.copy_of(np.concatenate((np.asarray(left), np.asarray(right))))
+        dst = SharedArray(src.shape, src.dtype)
+        try:
+            self.choose_backend(src.array)
+            self.run(_merge_path_tasks(src, dst, 0, len(left), len(src), self._workers))
+            return dst.array.tolist() if isinstance(left, list) else dst.detach()
+        finally:
+            src.unlink()
+            dst.unlink()
+
+
+_default_sorters = {}
+
+
+def get_default_sorter(num_workers=None, backend='auto'):
+    """
+    Returns the sorter of the module with the given number of workers and backend, its pools are reused
+    by all the calls.
+    """
+    if (num_workers, backend) not in _default_sorters:
+        _default_sorters[num_workers, backend] = ParallelSorter(num_workers, backend)
+        atexit.register(_default_sorters[num_workers, backend].close)
+    return _default_sorters[num_workers, backend]
+
+
+def sort(data, algorithm='merge', workers=None, verbose=False, key=None, argsort=False, backend='auto',
+         output=None):
+    """
+    Sorts data in parallel with one of the algorithms of ParallelSorter on a pool shared by the calls.
+    :param data: list, ndarray of any dtype or dataset.Dataset, structured arrays are sorted by their fields
+                 in order
+    :param algorithm: 'merge', 'kway', 'sample' or 'radix' (integer keys only)
+    :param workers: maximum number of workers, defaults to number of CPUs
+    :param key: name of the field of a structured array or function of the whole array returning
+                the array of keys, the data is sorted by the keys
+    :param argsort: if True, the permutation which sorts the data is returned instead
+    :param backend: 'serial', 'thread', 'process' or 'auto' to pick it from the size of data
+    :param output: optional path to a dataset file the result is written to
+    :return: sorted list if data is a list, otherwise sorted ndarray over the result buffer
+    """
+    sorter = get_default_sorter(workers, backend)
+    algorithms = {
+        'merge': sorter.merge_sort,
+        'kway': sorter.kway_merge_sort,
+        'sample': sorter.sample_sort,
+        'radix': sorter.radix_sort,
+    }
+    if algorithm not in algorithms:
+        raise ValueError("unknown algorithm {0}, use one of {1}".format(algorithm, sorted(algorithms)))
+    result = algorithms[algorithm](data, verbose, key=key, argsort=argsort)
+    if output is not None:
+        with tracing.span('write output', 'sort'):
+            dataset.write(output, result)
+    return result
+
+
+def pooled_merge_sort(data, verbose=False):
+    """
+    Parallel merge sort on the shared pool of the module, see ParallelSorter.merge_sort
+    :param data: list or ndarray of numbers
+    :return: sorted list if data is a list, otherwise sorted ndarray
+    """
+    return get_default_sorter().merge_sort(data, verbose)
+
+
+def pooled_kway_merge_sort(data, verbose=False):
+    """
+    Parallel merge sort with a single k-way merge on the shared pool of the module,
+    see ParallelSorter.kway_merge_sort
+    :param data: list or ndarray of numbers
+    :return: sorted list if data is a list, otherwise sorted ndarray
+    """
+    return get_default_sorter().kway_merge_sort(data, verbose)
+
+
+def pooled_sample_sort(data, verbose=False):
+    """
+    Parallel sample sort on the shared pool of the module, see ParallelSorter.sample_sort
+    """
+    return get_default_sorter().sample_sort(data, verbose)
+
+
+def pooled_radix_sort(data, verbose=False):
+    """
+    Parallel LSD radix sort on the shared pool of the module, see ParallelSorter.radix_sort
+    """
+    return get_default_sorter().radix_sort(data, verbose)
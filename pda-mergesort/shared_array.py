@@ -0,0 +1,110 @@
+import sys
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+_attach_lock = threading.Lock()
+
+
+def _attach_shared_memory(name):
+    """
+    Attaches to an existing shared memory block without registering it with the resource tracker,
+    which would unlink the block when the attaching worker exits: the process which created
+    the block is responsible for unlinking it.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # tasks run by a thread executor attach concurrently, the patch must not be interleaved
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class SharedArray(object):
+    """
+    NumPy array in a shared memory block. When it is passed to a worker process only the name,
+    shape and dtype of the block are pickled and the worker attaches to the same memory,
+    so no element is copied. The process which created the block has to unlink() it.
+    """
+    def __init__(self, shape, dtype, name=None):
+        """
+        :param shape: shape of the array
+        :param dtype: anything np.dtype accepts
+        :param name: name of an existing block to attach to, a new block is created if None
+        """
+        self.shape = tuple(shape) if np.ndim(shape) else (int(shape),)
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+        if name is None:
+            size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = _attach_shared_memory(name)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def copy_of(cls, data, dtype=None):
+        """
+        Creates a shared array with a copy of data.
+        """
+        data = np.asarray(data, dtype=dtype)
+        shared = cls(data.shape, data.dtype)
+        shared.array[...] = data
+        return shared
+
+    def __getstate__(self):
+        return self.shm.name, self.shape, self.dtype
+
+    def __setstate__(self, state):
+        name, shape, dtype = state
+        self.__init__(shape, dtype, name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def close(self):
+        """
+        Detaches from the block, views of array must not be used afterwards. Does nothing for the shared array
+        which created the block: serial and thread executors run tasks in the process which owns it, their
+        close() at the end of a task must not unmap it, the owner stays attached until unlink().
+        """
+        if not self.owner:
+            self._close()
+
+    def _close(self):
+        self.array = None
+        if self.shm is not None:
+            self.shm.close()
+
+    def unlink(self):
+        """
+        Frees the block, should be called by the process which created it. Does nothing if the block
+        is already unlinked or detached.
+        """
+        if self.shm is not None:
+            self._close()
+            self.shm.unlink()
+            self.shm = None
+
+    def detach(self):
+        """
+        Unlinks the block and hands its memory over to a new ndarray, so the result of a computation
+        can be returned without copying it out of shared memory. The memory stays mapped until the
+        returned array and all its views are garbage collected. The shared array can't be used afterwards.
+        :return: ndarray over the memory of the block
+        """
+        array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm._mmap)
+        self.array = None
+        self.shm.unlink()
+        # the mapping belongs to the array now, close() of SharedMemory must not unmap it
+        self.shm._buf.release()
+        self.shm._buf = self.shm._mmap = None
+        self.shm.close()
+        self.shm = None
+        return array
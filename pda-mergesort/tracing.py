@@ -0,0 +1,146 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+# tracing is off by default, span() and traced() cost a check of this flag then
+enabled = False
+
+# events of this process: (name, category, start, duration, pid, tid, args), times in microseconds
+_events = []
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+def _now():
+    # perf_counter is system-wide, so times taken in the workers and in the calling process line up
+    return time.perf_counter() * 1e6
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def record(name, start, end, category='', args=None):
+    """
+    Records a span which is already measured, times are in microseconds of _now().
+    """
+    _events.append((name, category, start, end - start, os.getpid(), threading.get_ident(), args))
+
+
+class _Span(object):
+    __slots__ = ('name', 'category', 'args', 'start')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.name, self.start, _now(), self.category, self.args)
+
+
+def span(name, category='', **args):
+    """
+    Context manager which records the time spent in its block, if tracing is enabled.
+    >> with tracing.span('shuffle', 'mapreduce', partitions=16):
+    """
+    if not enabled:
+        return _NO_SPAN
+    return _Span(name, category, args or None)
+
+
+class _TracedResult(object):
+    """
+    Result of a traced task together with the events recorded by the worker.
+    """
+    def __init__(self, value, events, end):
+        self.value = value
+        self.events = events
+        self.end = end
+
+
+def _run_traced(name, function, args, submitted, pid):
+    global enabled
+    if os.getpid() == pid:
+        # serial and thread executors run the task in the calling process, which records its events itself
+        record('queue wait', submitted, _now(), 'wait', {'task': name})
+        with _Span(name, 'task', None):
+            return function(*args)
+    was_enabled, enabled = enabled, True
+    first = len(_events)
+    start = _now()
+    record('queue wait', submitted, start, 'wait', {'task': name})
+    try:
+        with _Span(name, 'task', None):
+            value = function(*args)
+    finally:
+        enabled = was_enabled
+    # a forked worker inherits the events of its parent, only the ones of this task are sent back
+    events = _events[first:]
+    del _events[first:]
+    return _TracedResult(value, events, _now())
+
+
+def traced(name, function, args):
+    """
+    Wraps a task submitted to a worker pool, so that the worker records the time the task waited
+    in the queue and the time it ran. The result has to be unwrapped with result().
+    :return: (function, args) to submit instead
+    """
+    if not enabled:
+        return function, args
+    return _run_traced, (name, function, args, _now(), os.getpid())
+
+
+def result(value):
+    """
+    Unwraps the result of a task wrapped by traced(): events of the worker are added to the events
+    of this process, together with the time the result took to come back (ipc).
+    """
+    if not isinstance(value, _TracedResult):
+        return value
+    _events.extend(value.events)
+    record('ipc', value.end, _now(), 'ipc')
+    return value.value
+
+
+def collect():
+    """
+    :return: list of the recorded events, which are cleared
+    """
+    events = list(_events)
+    del _events[:]
+    return events
+
+
+def chrome_trace(events):
+    """
+    :return: dict in the trace event format of chrome://tracing and Perfetto
+    """
+    trace_events = []
+    for name, category, start, duration, pid, tid, args in events:
+        event = {'name': name, 'cat': category, 'ph': 'X', 'ts': start, 'dur': duration, 'pid': pid, 'tid': tid}
+        if args:
+            event['args'] = args
+        trace_events.append(event)
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+def export_chrome_trace(path, events=None):
+    """
+    Writes events (all the recorded ones by default, which are cleared) to a JSON file for chrome://tracing.
+    """
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(collect() if events is None else events), f)
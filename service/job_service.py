@@ -0,0 +1,313 @@
+"""
+Runs MapReduce, sort and scan jobs from asyncio code on a fleet of workers shared by all the jobs:
+
+    async with JobService(num_workers=4, max_running=4, max_queued=64) as service:
+        handle = await service.submit(run_sort, data, 'kway')
+        print(handle.progress)
+        sorted_data = await handle
+
+Submitted jobs wait in a bounded queue, at most max_running of them run at a time. The coordinator of every
+job runs on its own thread, so the event loop is never blocked, and the tasks of all the running jobs go
+to the same pool. Every job has at most two tasks per worker in the queue of the pool, so tasks of concurrent
+jobs interleave and a large job doesn't hold up the small ones submitted after it.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for project in ('da-mapreduce', 'dist_alg_lab_1', 'pda-mergesort'):
+    sys.path.insert(0, os.path.join(ROOT, project))
+
+import executors
+from parallel_mapreduce import MapReduce
+from parallel_scan import ParallelScanner
+from parallel_sort import ParallelSorter
+
+
+class JobCancelled(Exception):
+    """
+    Raised in the coordinator of a running job which is cancelled, when it submits its next task.
+    """
+
+
+class _JobPool(object):
+    """
+    View of the shared fleet for one job, with the interface of a pool the algorithms take as their backend.
+    It counts the tasks of the job for its progress, limits the number of them in the queue of the fleet
+    and stops the job once it is cancelled. close() and join() leave the fleet running.
+    """
+    def __init__(self, fleet, handle, num_workers):
+        self.fleet = fleet
+        self.handle = handle
+        self.num_workers = num_workers
+        self._slots = threading.BoundedSemaphore(2 * num_workers)
+
+    def _finished(self, callback, value):
+        self.handle._task_finished()
+        self._slots.release()
+        if callback is not None:
+            callback(value)
+
+    def apply_async(self, func, args=(), kwds=None, callback=None, error_callback=None):
+        self._slots.acquire()
+        if self.handle.cancel_requested:
+            self._slots.release()
+            raise JobCancelled("job {0} is cancelled".format(self.handle.id))
+        self.handle._task_submitted()
+        try:
+            return self.fleet.apply_async(func, args, kwds or {}, functools.partial(self._finished, callback),
+                                          functools.partial(self._finished, error_callback))
+        except Exception:
+            self._slots.release()
+            raise
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class JobHandle(object):
+    """
+    Handle of a submitted job: its state, progress and result. Awaiting the handle returns the result
+    of the job or raises its exception, asyncio.CancelledError if the job is cancelled.
+    """
+    def __init__(self, job_id, name, future):
+        self.id = job_id
+        self.name = name
+        # 'queued', 'running', 'done', 'failed' or 'cancelled'
+        self.state = 'queued'
+        self.cancel_requested = False
+        self.tasks_submitted = 0
+        self.tasks_finished = 0
+        self._future = future
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<Job {0} {1}: {2}, {3} of {4} tasks finished>".format(self.id, self.name, self.state,
+                                                                      *self.progress)
+
+    def __await__(self):
+        return asyncio.shield(self._future).__await__()
+
+    @property
+    def progress(self):
+        """
+        :return: (finished tasks, submitted tasks), jobs submit their tasks as they go,
+                 so the number of submitted tasks grows until the job is done
+        """
+        return self.tasks_finished, self.tasks_submitted
+
+    def _task_submitted(self):
+        with self._lock:
+            self.tasks_submitted += 1
+
+    def _task_finished(self):
+        with self._lock:
+            self.tasks_finished += 1
+
+    def _finish(self, state, result=None, error=None):
+        self.state = state
+        if self._future.done():
+            return
+        if state == 'cancelled':
+            self._future.cancel()
+        elif error is not None:
+            self._future.set_exception(error)
+        else:
+            self._future.set_result(result)
+
+    def done(self):
+        return self._future.done()
+
+    def cancel(self):
+        """
+        Cancels the job: a queued job is dropped, a running one is stopped when it submits its next task,
+        its tasks which are already submitted run to the end.
+        :return: False if the job is already finished
+        """
+        if self.done():
+            return False
+        self.cancel_requested = True
+        if self.state == 'queued':
+            self._finish('cancelled')
+        return True
+
+    async def result(self):
+        return await self
+
+
+class JobService(object):
+    """
+    Runs jobs submitted from asyncio code on a shared fleet of workers. A job is a function which takes
+    a pool as its first argument and runs an algorithm on it, like run_map_reduce, run_sort and run_scan.
+    """
+    def __init__(self, num_workers=None, backend='process', max_running=4, max_queued=64):
+        """
+        :param num_workers: size of the fleet, defaults to number of CPUs or to the size of the backend pool
+        :param backend: 'serial', 'thread' or 'process' (see executors.BACKENDS) or a pool object like
+                        distributed.RemotePool, which is used as it is and not closed by close()
+        :param max_running: number of jobs run at a time
+        :param max_queued: number of jobs waiting to run, submit waits or fails when the queue is full
+        """
+        self.num_workers = num_workers or getattr(backend, 'num_workers', None) or multiprocessing.cpu_count()
+        self.backend = backend
+        self.max_running = max_running
+        self.max_queued = max_queued
+        # id -> handle of every job which is queued or running
+        self.jobs = {}
+        self._ids = itertools.count()
+        self._fleet = None
+        self._queue = None
+        self._threads = None
+        self._runners = []
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close(cancel=exc_type is not None)
+
+    def start(self):
+        """
+        Starts the fleet and the runners of jobs, it has to be called from the event loop.
+        """
+        if isinstance(self.backend, str):
+            self._fleet = executors.make_pool(self.backend, self.num_workers)
+        else:
+            self._fleet = self.backend
+        self._queue = asyncio.Queue(self.max_queued)
+        self._threads = concurrent.futures.ThreadPoolExecutor(self.max_running, thread_name_prefix='job')
+        self._runners = [asyncio.ensure_future(self._run_jobs()) for _ in range(self.max_running)]
+        return self
+
+    async def close(self, cancel=False):
+        """
+        Waits for the queued and running jobs to finish and shuts the fleet down.
+        :param cancel: if True, the jobs are cancelled instead
+        """
+        if self._fleet is None:
+            return
+        if cancel:
+            for handle in list(self.jobs.values()):
+                handle.cancel()
+        await self._queue.join()
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+        self._threads.shutdown()
+        if isinstance(self.backend, str):
+            executors.shutdown(self._fleet)
+        self._fleet = None
+
+    async def submit(self, function, *args, name=None, wait=True, **kwargs):
+        """
+        Queues function(pool, *args, **kwargs) to run on the fleet.
+        :param name: name of the job, the name of the function by default
+        :param wait: if the queue is full, wait for a free place in it, otherwise raise asyncio.QueueFull
+        :return: JobHandle
+        """
+        if self._fleet is None:
+            raise RuntimeError("JobService is not started")
+        handle = JobHandle(next(self._ids), name or function.__name__, asyncio.get_running_loop().create_future())
+        job = handle, function, args, kwargs
+        self.jobs[handle.id] = handle
+        try:
+            if wait:
+                await self._queue.put(job)
+            else:
+                self._queue.put_nowait(job)
+        except BaseException:
+            del self.jobs[handle.id]
+            raise
+        return handle
+
+    async def _run_jobs(self):
+        """
+        Runner of jobs: takes the next job from the queue and runs it on a coordinator thread.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            handle, function, args, kwargs = await self._queue.get()
+            try:
+                if handle.cancel_requested:
+                    continue
+                handle.state = 'running'
+                pool = _JobPool(self._fleet, handle, self.num_workers)
+                try:
+                    result = await loop.run_in_executor(self._threads,
+                                                        functools.partial(function, pool, *args, **kwargs))
+                except JobCancelled:
+                    handle._finish('cancelled')
+                except Exception as error:
+                    handle._finish('failed', error=error)
+                else:
+                    handle._finish('done', result)
+            finally:
+                self.jobs.pop(handle.id, None)
+                self._queue.task_done()
+
+
+def run_map_reduce(pool, the_mapper, the_reducer, inputs, num_chunks=None, **options):
+    """
+    Job running MapReduce, the mapper and the reducer have to be importable by the workers.
+    :param num_chunks: number of chunks to split the work of map and reduce into, the size of the pool by default
+    :param options: other arguments of MapReduce, like the_combiner or spill_threshold
+    :return: list of (key, value)
+    """
+    with MapReduce(the_mapper, the_reducer, backend=pool, **options) as job:
+        return list(job(inputs, num_chunks or pool.num_workers))
+
+
+def run_sort(pool, data, algorithm='merge', **options):
+    """
+    Job sorting data with one of the algorithms of ParallelSorter.
+    :param algorithm: 'merge', 'kway', 'sample' or 'radix'
+    :param options: other arguments of the sort, like key or argsort
+    """
+    methods = {'merge': 'merge_sort', 'kway': 'kway_merge_sort', 'sample': 'sample_sort', 'radix': 'radix_sort'}
+    if algorithm not in methods:
+        raise ValueError("unknown algorithm {0}, use one of {1}".format(algorithm, sorted(methods)))
+    with ParallelSorter(backend=pool) as sorter:
+        return getattr(sorter, methods[algorithm])(data, **options)
+
+
+def run_scan(pool, data, op='sum', **options):
+    """
+    Job computing a scan of data with ParallelScanner.scan.
+    :param options: other arguments of the scan, like exclusive or flags
+    """
+    with ParallelScanner(backend=pool) as scanner:
+        return scanner.scan(data, op, **options)
+
+
+async def _demo():
+    import numpy as np
+    from digit_count import digit_count_mapper, digit_count_reducer
+
+    async with JobService(max_running=3, max_queued=8) as service:
+        handles = [await service.submit(run_sort, np.random.rand(2 ** 20), 'kway'),
+                   await service.submit(run_scan, np.random.randint(0, 10, 2 ** 20)),
+                   await service.submit(run_map_reduce, digit_count_mapper, digit_count_reducer,
+                                        np.random.randint(0, 10, 2 ** 14).tolist(), the_combiner=digit_count_reducer),
+                   await service.submit(run_sort, np.random.randint(0, 2 ** 30, 2 ** 20), 'radix')]
+        handles[-1].cancel()
+        while not all(handle.done() for handle in handles):
+            print(handles)
+            await asyncio.sleep(0.1)
+        for handle in handles:
+            print(handle)
+
+
+if __name__ == '__main__':
+    asyncio.run(_demo())
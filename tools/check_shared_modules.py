@@ -0,0 +1,50 @@
+"""
+The projects are run on their own, each from its directory, so the modules they share are copied into every
+one of them. This checks that the copies are identical, run it after changing any of them:
+
+    python tools/check_shared_modules.py
+
+It prints a diff of every copy which differs from the first one and exits with status 1.
+"""
+import difflib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module -> projects holding a copy of it
+SHARED_MODULES = {
+    'dataset.py': ('da-mapreduce', 'dist_alg_lab_1', 'pda-mergesort'),
+    'executors.py': ('da-mapreduce', 'dist_alg_lab_1', 'pda-mergesort'),
+    'tracing.py': ('da-mapreduce', 'dist_alg_lab_1', 'pda-mergesort'),
+    'shared_array.py': ('dist_alg_lab_1', 'pda-mergesort'),
+}
+
+
+def diverged_copies(root=ROOT):
+    """
+    :return: list of (module, path of the first copy, path of a differing copy, unified diff)
+    """
+    diverged = []
+    for module, projects in sorted(SHARED_MODULES.items()):
+        paths = [os.path.join(root, project, module) for project in projects]
+        with open(paths[0]) as f:
+            reference = f.readlines()
+        for path in paths[1:]:
+            with open(path) as f:
+                copy = f.readlines()
+            if copy != reference:
+                diff = difflib.unified_diff(reference, copy, os.path.relpath(paths[0], root),
+                                            os.path.relpath(path, root))
+                diverged.append((module, paths[0], path, ''.join(diff)))
+    return diverged
+
+
+if __name__ == '__main__':
+    diverged = diverged_copies()
+    for module, reference, path, diff in diverged:
+        print("{0} differs from {1}:".format(os.path.relpath(path, ROOT), os.path.relpath(reference, ROOT)))
+        print(diff)
+    if diverged:
+        sys.exit(1)
+    print("All copies of {0} are identical".format(', '.join(sorted(SHARED_MODULES))))